@@ -1,23 +1,50 @@
-import time
-from threading import Thread
+import os
+from datetime import datetime
 
 import streamlit as st
 from dotenv import load_dotenv
 
+from src.alerts import (
+    TIPOS_REGRA,
+    LIMITE_MS,
+    carregar_regras,
+    cubo_diario,
+    ler_alertas,
+    salvar_regras,
+    versao_dados,
+)
 from src.auth import show_login
-from src.bbce_api import connect_bbce, refresh_deals
+from src.bbce_api import connect_bbce, refresh_deals, restaurar_dados
 from src.charts import plot_produto_com_volume, plot_spread_area
+from src.intraday import aplicar_barra_intraday, poll_intraday
+from src.memory import configuracao as configuracao_memoria
+from src.memory import iniciar_refresh, registrar_sessao, relatorio_memoria
+from src.retention import barras_do_produto
 from src.data_processing import (
     build_ohlc,
     calcular_indicadores,
+    calcular_volume_profile,
     calcular_vwap,
     criar_tabela_ohlc,
+    criar_tabela_screener,
     get_filtered_data_by_range,
 )
 
 # Carrega variáveis do .env em desenvolvimento local
 load_dotenv()
 
+# Intervalo (s) entre buscas dos negócios do dia para o painel ao vivo
+INTRADAY_POLL_S = 30
+
+# Intervalo (s) da atualização automática dos deals em background
+REFRESH_S = 1200
+
+# Largura de cada gráfico, usada para limitar quantos candles/pontos são
+# enviados ao navegador: layout wide em 3 colunas, descontando as margens da
+# página (2 x 16 px) e a área de plotagem (margens e eixo y, ~60 px)
+LARGURA_TELA_PX = int(os.getenv("LARGURA_TELA_PX", "1920"))
+LARGURA_GRAFICO_PX = (LARGURA_TELA_PX - 32) // 3 - 60
+
 # ==================== CONFIGURAÇÃO DA PÁGINA ====================
 st.set_page_config(
     page_title="BEM Energia Dashboard",
@@ -62,12 +89,72 @@ st.markdown(
 )
 
 
-# ==================== ATUALIZAÇÃO AUTOMÁTICA ====================
-def _auto_refresh_thread():
-    """Recarrega deals a cada 20 minutos em background."""
-    while True:
-        time.sleep(1200)
-        refresh_deals()
+# ==================== PERFIL DE VOLUME ====================
+@st.cache_data(max_entries=256, show_spinner=False)
+def _perfil_volume(product_id, range_type: str, tamanho_bin: float, versao, hoje, _df_raw):
+    """
+    Perfil de volume em cache por (produto, período, bin, versão dos dados,
+    dia): o início do período é contado a partir de hoje. Só usa os deals
+    brutos (RETENCAO_DEALS_DIAS), não as barras agregadas.
+    """
+    return calcular_volume_profile(
+        get_filtered_data_by_range(_df_raw, range_type), tamanho_bin
+    )
+
+
+# ==================== SCREENER ====================
+@st.cache_data(max_entries=4, show_spinner=False)
+def _screener(versao, _df_all, _produtos):
+    """Screener de todos os produtos em cache por versão dos dados."""
+    cubo, lote = cubo_diario(versao, _df_all)
+    return criar_tabela_screener(cubo, lote, _produtos)
+
+
+# ==================== PAINEL AO VIVO ====================
+@st.fragment(run_every=INTRADAY_POLL_S)
+def _painel_intraday(produtos_exibidos: list):
+    """
+    Último negócio e estatísticas do dia dos produtos exibidos.
+    Atualiza sozinho a cada INTRADAY_POLL_S, sem reexecutar o resto da página:
+    o candle do dia é atualizado na próxima execução completa, ou logo que
+    chegam negócios desses produtos se "Gráficos ao vivo" estiver ligado.
+    """
+    # Atualização periódica não é uso: a aba pode estar esquecida aberta
+    registrar_sessao(interacao=False)
+    # Memória liberada (aba ficou parada): reconstrói só quando o usuário voltar
+    if st.session_state.get("memoria_liberada"):
+        st.info("Dados liberados por inatividade. Interaja com a página para recarregar.")
+        return
+    novos = poll_intraday({p["id"] for p in produtos_exibidos}, INTRADAY_POLL_S)
+    barras = st.session_state.get("intraday", {})
+
+    colunas = st.columns(len(produtos_exibidos))
+    for col, produto in zip(colunas, produtos_exibidos):
+        barra = barras[produto["id"]].barra() if produto["id"] in barras else None
+        with col:
+            if not barra:
+                st.caption(f"{produto['description']}: sem negócios hoje")
+                continue
+            variacao = barra["close"] - barra["open"]
+            st.metric(
+                f"{produto['description']} • {barra['ultimo_negocio']:%H:%M:%S}",
+                f"R$ {barra['close']:.2f}",
+                f"{variacao:+.2f} no dia",
+            )
+            st.caption(
+                f"Máx {barra['high']:.2f} • Mín {barra['low']:.2f} • "
+                f"Pmédio {barra['vwap']:.2f} • {barra['volume']:,.0f} MWm • "
+                f"{barra['negocios']} negócios"
+            )
+
+    if novos & {p["id"] for p in produtos_exibidos}:
+        # Reexecutar a página inteira custa ~0,5 s por sessão: só sob demanda
+        if st.session_state.get("graficos_ao_vivo"):
+            st.session_state.rerun_automatico = True
+            st.rerun()
+        st.session_state.candle_pendente = True
+    if st.session_state.get("candle_pendente"):
+        st.caption("Novos negócios: o candle do dia atualiza na próxima interação.")
 
 
 # ==================== INTERFACE PRINCIPAL ====================
@@ -77,6 +164,8 @@ def main():
         st.session_state.autenticado = False
     if "logado_bbce" not in st.session_state:
         st.session_state.logado_bbce = False
+    # Execução completa conta como uso, salvo o rerun de "Gráficos ao vivo"
+    registrar_sessao(interacao=not st.session_state.pop("rerun_automatico", False))
 
     st.markdown(
         "<h1 style='text-align:center; margin:0.1rem 0;'>📊 BEM Energia Dashboard</h1>",
@@ -93,20 +182,36 @@ def main():
         st.info("Usuário autenticado. Conectando à BBCE e carregando dados...")
         with st.spinner("Conectando..."):
             if connect_bbce():
-                # Inicia thread de atualização automática
-                t = Thread(target=_auto_refresh_thread, daemon=True)
-                t.start()
                 st.rerun()
             else:
                 if st.button("Tentar novamente"):
                     st.rerun()
                 return
 
+    # --- Dados liberados por ociosidade: reconstrói a partir dos caches ---
+    if st.session_state.get("memoria_liberada"):
+        with st.spinner("Recarregando dados..."):
+            if not restaurar_dados():
+                # Token expirado ou API fora: refaz a conexão completa
+                del st.session_state["memoria_liberada"]
+                st.session_state.logado_bbce = False
+                st.rerun()
+
+    # Atualização automática em background (reinicia após liberação); se os
+    # dados já passaram do intervalo, a primeira atualização é imediata
+    idade_s = (datetime.now() - st.session_state.ultima_atualizacao).total_seconds()
+    iniciar_refresh(refresh_deals, REFRESH_S, max(REFRESH_S - idade_s, 0))
+
     # --- Cabeçalho com data de atualização ---
     if st.session_state.get("ultima_atualizacao"):
         ts = st.session_state.ultima_atualizacao.strftime("%d/%m/%Y %H:%M")
+        agregados = st.session_state.get("agregados")
+        if agregados is not None and not agregados.empty:
+            inicio = agregados.index.min()
+        else:
+            inicio = st.session_state.df.index.min()
         st.markdown(
-            f"<p class='update-info'>Dados desde 01/01/2025 • Atualizado em {ts}</p>",
+            f"<p class='update-info'>Dados desde {inicio:%d/%m/%Y} • Atualizado em {ts}</p>",
             unsafe_allow_html=True,
         )
 
@@ -115,10 +220,18 @@ def main():
     with col_ind:
         indicadores = st.multiselect(
             "📊 Indicadores",
-            options=["SMA8", "SMA20", "SMA50", "Bollinger Bands 8"],
+            options=["SMA8", "SMA20", "SMA50", "Bollinger Bands 8", "Volume Profile"],
             default=["SMA8", "SMA20"],
             key="indicadores_main",
         )
+        tamanho_bin = 1.0
+        if "Volume Profile" in indicadores:
+            tamanho_bin = st.select_slider(
+                "Faixa do perfil (R$/MWh)",
+                options=[0.5, 1.0, 2.0, 5.0, 10.0],
+                value=1.0,
+                key="bin_perfil",
+            )
     with col_period:
         periodo = st.radio(
             "Período",
@@ -165,38 +278,80 @@ def main():
     produto2 = produtos[idx2]
     df_all = st.session_state.df
 
+    # --- Último negócio do dia (atualizado entre as cargas completas) ---
+    poll_intraday({produto1["id"], produto2["id"]}, INTRADAY_POLL_S)
+    st.toggle(
+        "Gráficos ao vivo",
+        value=False,
+        key="graficos_ao_vivo",
+        help="Recarrega a página a cada negócio novo dos produtos exibidos.",
+    )
+    # Esta execução completa já redesenha o candle do dia
+    st.session_state.candle_pendente = False
+    _painel_intraday([produto1, produto2])
+    barras = st.session_state.get("intraday", {})
+
     # --- Dados completos por produto ---
     df_raw1 = df_all[df_all["productId"] == produto1["id"]]
     df_raw2 = df_all[df_all["productId"] == produto2["id"]]
 
-    vwap1 = calcular_vwap(df_raw1)
-    vwap2 = calcular_vwap(df_raw2)
+    # Barra do dia vem do intraday quando for mais recente que o histórico
+    barra1 = barras[produto1["id"]].barra() if produto1["id"] in barras else None
+    barra2 = barras[produto2["id"]].barra() if produto2["id"] in barras else None
+    # Barras agregadas (períodos fora da janela de deals brutos) vêm antes
+    antigas1 = barras_do_produto(st.session_state.get("agregados"), produto1["id"])
+    antigas2 = barras_do_produto(st.session_state.get("agregados"), produto2["id"])
+    historico_em = st.session_state.get("ultima_atualizacao")
+    ohlc1, vwap1 = aplicar_barra_intraday(
+        build_ohlc(df_raw1, antigas1), calcular_vwap(df_raw1, antigas1), barra1, historico_em
+    )
+    ohlc2, vwap2 = aplicar_barra_intraday(
+        build_ohlc(df_raw2, antigas2), calcular_vwap(df_raw2, antigas2), barra2, historico_em
+    )
 
-    df_ohlc1_full = calcular_indicadores(build_ohlc(df_raw1), indicadores)
-    df_ohlc2_full = calcular_indicadores(build_ohlc(df_raw2), indicadores)
+    df_ohlc1_full = calcular_indicadores(ohlc1, indicadores)
+    df_ohlc2_full = calcular_indicadores(ohlc2, indicadores)
 
     # --- Filtro de período apenas para visualização ---
     range_type = st.session_state.get("range_type", "2M")
     df_ohlc1 = get_filtered_data_by_range(df_ohlc1_full, range_type)
     df_ohlc2 = get_filtered_data_by_range(df_ohlc2_full, range_type)
 
+    perfil1 = perfil2 = None
+    if "Volume Profile" in indicadores:
+        versao = st.session_state.get("deals_hash")
+        hoje = datetime.now().date()
+        perfil1 = _perfil_volume(
+            produto1["id"], range_type, tamanho_bin, versao, hoje, df_raw1
+        )
+        perfil2 = _perfil_volume(
+            produto2["id"], range_type, tamanho_bin, versao, hoje, df_raw2
+        )
+
     # --- Gráficos ---
     col_g1, col_g2, col_g3 = st.columns(3)
     with col_g1:
         st.plotly_chart(
-            plot_produto_com_volume(df_ohlc1, indicadores),
+            plot_produto_com_volume(
+                df_ohlc1, indicadores, perfil=perfil1, largura_px=LARGURA_GRAFICO_PX
+            ),
             use_container_width=True,
             config={"displayModeBar": False},
         )
     with col_g2:
         st.plotly_chart(
-            plot_produto_com_volume(df_ohlc2, indicadores),
+            plot_produto_com_volume(
+                df_ohlc2, indicadores, perfil=perfil2, largura_px=LARGURA_GRAFICO_PX
+            ),
             use_container_width=True,
             config={"displayModeBar": False},
         )
     with col_g3:
         st.plotly_chart(
-            plot_spread_area(df_ohlc1, df_ohlc2, produto1["description"], produto2["description"]),
+            plot_spread_area(
+                df_ohlc1, df_ohlc2, produto1["description"], produto2["description"],
+                largura_px=LARGURA_GRAFICO_PX,
+            ),
             use_container_width=True,
             config={"displayModeBar": False},
         )
@@ -232,6 +387,110 @@ def main():
     with col_t3:
         st.markdown("")
 
+    # --- Screener ---
+    with st.expander("🔎 Screener"):
+        tabela_screener = _screener(versao_dados(df_all), df_all, produtos)
+        if not tabela_screener.empty:
+            st.dataframe(
+                tabela_screener,
+                use_container_width=True,
+                hide_index=True,
+                height=400,
+                column_config={
+                    "Close": st.column_config.NumberColumn("Fechamento", format="R$ %.2f"),
+                    "Dist SMA20 (%)": st.column_config.NumberColumn(format="%.2f%%"),
+                    "%B": st.column_config.NumberColumn(format="%.2f"),
+                    "Vol (MWm)": st.column_config.NumberColumn("Volume", format="%d"),
+                    "Vol médio 20d": st.column_config.NumberColumn(format="%d"),
+                },
+            )
+        else:
+            st.info("Sem dados para exibir")
+
+    # --- Alertas ---
+    with st.expander("🔔 Alertas"):
+        tempos = st.session_state.get("alertas_tempos")
+        if tempos:
+            st.caption(
+                f"{tempos['regras']} regras avaliadas em {tempos['avaliacao_ms']:.1f} ms "
+                f"(cubo diário: {tempos['cubo_ms']:.1f} ms)"
+                + (" ⚠️ acima do limite" if tempos["avaliacao_ms"] > LIMITE_MS else "")
+            )
+
+        alertas = ler_alertas()
+        nome_por_id = {p["id"]: p["description"] for p in produtos}
+        if alertas:
+            st.dataframe(
+                [
+                    {
+                        "Data": a["data"],
+                        "Produto": nome_por_id.get(a["produto"], a["produto"]),
+                        "Regra": a["tipo"],
+                        "Valor": a.get("valor"),
+                        "Fechamento": a["close"],
+                        "Disparado em": a["disparado_em"],
+                    }
+                    for a in alertas
+                ],
+                use_container_width=True,
+                hide_index=True,
+                height=210,
+            )
+        else:
+            st.info("Nenhum alerta disparado")
+
+        with st.form("nova_regra"):
+            col_r1, col_r2, col_r3, col_r4 = st.columns(4)
+            with col_r1:
+                tipo = st.selectbox("Regra", options=list(TIPOS_REGRA))
+            with col_r2:
+                idx_a = st.selectbox(
+                    "Produto", options=range(len(nomes)), format_func=lambda x: nomes[x]
+                )
+            with col_r3:
+                idx_b = st.selectbox(
+                    "Produto B (spread)", options=range(len(nomes)),
+                    format_func=lambda x: nomes[x],
+                )
+            with col_r4:
+                valor = st.number_input("Valor (R$/MWh)", value=0.0, step=1.0)
+            if st.form_submit_button("Adicionar regra"):
+                regras = carregar_regras()
+                regras.append(
+                    {
+                        "id": max((r.get("id", 0) for r in regras), default=0) + 1,
+                        "tipo": tipo,
+                        "produto": produtos[idx_a]["id"],
+                        "produto_b": produtos[idx_b]["id"],
+                        "valor": valor,
+                    }
+                )
+                salvar_regras(regras)
+                st.success("Regra adicionada. Será avaliada na próxima atualização.")
+
+    # --- Memória ---
+    with st.expander("🧠 Memória"):
+        relatorio = relatorio_memoria()
+        orcamento = configuracao_memoria()["orcamento_bytes"]
+        st.caption(
+            f"Total {relatorio['bytes'].sum() / 1e6:,.1f} MB de "
+            f"{orcamento / 1e6:,.0f} MB • sessões ociosas liberadas acima do orçamento"
+        )
+        if not relatorio.empty:
+            st.dataframe(
+                relatorio.assign(MB=relatorio["bytes"] / 1e6).drop(columns="bytes"),
+                use_container_width=True,
+                hide_index=True,
+                height=210,
+                column_config={
+                    "sessao": "Sessão",
+                    "estrutura": "Estrutura",
+                    "MB": st.column_config.NumberColumn(format="%.2f"),
+                    "ociosa_min": st.column_config.NumberColumn("Ociosa (min)", format="%.0f"),
+                    "liberada": "Liberada",
+                },
+            )
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,151 @@
+"""
+Servidor HTTP local que imita os endpoints da BBCE usados pelo dashboard.
+Gera um histórico sintético e determinístico de deals para testes de carga.
+
+Uso:
+    python -m bench.bbce_stub --port 8765 --produtos 40 --deals-por-dia 300
+"""
+import argparse
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+
+def gerar_deals(
+    n_produtos: int = 40,
+    deals_por_dia: int = 300,
+    data_inicio: str = "2025-01-01",
+    data_fim: str | None = None,
+    seed: int = 42,
+) -> list:
+    """Gera deals sintéticos (passeio aleatório de preço por produto)."""
+    rng = np.random.default_rng(seed)
+    inicio = datetime.strptime(data_inicio, "%Y-%m-%d")
+    fim = datetime.strptime(data_fim, "%Y-%m-%d") if data_fim else datetime.now()
+    n_dias = max((fim - inicio).days + 1, 1)
+    n = n_dias * deals_por_dia
+
+    dias = np.sort(rng.integers(0, n_dias, n))
+    segundos = rng.integers(9 * 3600, 18 * 3600, n)
+    produtos = rng.zipf(1.6, n) % n_produtos + 1
+    base = 120 + 15 * np.arange(n_produtos + 1)
+    tendencia = np.cumsum(rng.normal(0, 1.5, (n_produtos + 1, n_dias)), axis=1)
+    precos = base[produtos] + tendencia[produtos, dias] + rng.normal(0, 2, n)
+    quantidades = rng.integers(1, 60, n)
+
+    deals = []
+    for i in range(n):
+        criado = inicio + timedelta(days=int(dias[i]), seconds=int(segundos[i]))
+        deals.append(
+            {
+                "id": i + 1,
+                "productId": int(produtos[i]),
+                "unitPrice": round(float(precos[i]), 2),
+                "quantity": int(quantidades[i]),
+                "createdAt": criado.strftime("%Y-%m-%dT%H:%M:%S"),
+                "originOperationType": "Match",
+                "status": "Ativo",
+            }
+        )
+    return deals
+
+
+def gerar_tickers(n_produtos: int = 40) -> list:
+    """Gera tickers com descrições no formato usado pela BBCE."""
+    return [
+        {"id": i, "description": f"SE CON MEN {i:02d}/26 - Preço Fixo"}
+        for i in range(1, n_produtos + 1)
+    ]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    deals: list = []
+    tickers: list = []
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, payload, status: int = 200):
+        corpo = json.dumps(payload).encode("utf-8")
+        etag = '"' + hashlib.sha256(corpo).hexdigest()[:16] + '"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def do_POST(self):
+        if urlparse(self.path).path.endswith("/bus/v2/login"):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self._responder(
+                {
+                    "userId": 1,
+                    "idToken": "stub-token",
+                    "companyId": 1,
+                    "refreshToken": "stub-refresh",
+                }
+            )
+        else:
+            self._responder({}, 404)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.endswith("/bus/v1/wallets"):
+            self._responder([{"id": "stub-wallet"}])
+        elif url.path.endswith("/bus/v1/negotiable-tickers"):
+            self._responder({"tickers": self.tickers})
+        elif url.path.endswith("/bus/v1/all-deals/report"):
+            inicio = query.get("initialPeriod", ["0000"])[0]
+            fim = query.get("finalPeriod", ["9999"])[0] + "T23:59:59"
+            self._responder(
+                [d for d in self.deals if inicio <= d["createdAt"] <= fim]
+            )
+        else:
+            self._responder({}, 404)
+
+
+def iniciar_stub(
+    port: int = 0, n_produtos: int = 40, deals_por_dia: int = 300
+) -> ThreadingHTTPServer:
+    """
+    Sobe o servidor em uma thread daemon e retorna a instância.
+    A URL base fica em f"http://127.0.0.1:{server.server_port}/".
+    """
+    handler = type(
+        "BBCEStubHandler",
+        (_Handler,),
+        {
+            "deals": gerar_deals(n_produtos, deals_por_dia),
+            "tickers": gerar_tickers(n_produtos),
+        },
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local imitando a API BBCE")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--produtos", type=int, default=40)
+    parser.add_argument("--deals-por-dia", type=int, default=300)
+    args = parser.parse_args()
+
+    server = iniciar_stub(args.port, args.produtos, args.deals_por_dia)
+    print(f"BBCE stub em http://127.0.0.1:{server.server_port}/")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
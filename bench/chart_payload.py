@@ -0,0 +1,207 @@
+"""
+Mede o tamanho do JSON das figuras e a fidelidade visual da redução por largura.
+
+Gera histórico diário sintético de vários anos para dois produtos e compara
+plot_produto_com_volume / plot_spread_area em detalhe completo (largura_px=None)
+com a renderização limitada pela largura do gráfico. A fidelidade é medida no
+espaço de pixels: para cada coluna de pixel, a faixa (mín/máx) ocupada pela
+linha original e pela reduzida; o erro é a diferença em pixels verticais
+(p95 e máximo entre as colunas).
+Os candles são conferidos pela envoltória (máxima, mínima, primeira abertura,
+último fechamento) e pelo volume total.
+Sai com código 1 se a envoltória ou os rótulos de último valor não baterem ou
+se algum erro passar dos limites.
+
+Uso:
+    python -m bench.chart_payload --anos 5 --largura 600 [--limite-p95 1 --limite-max 8]
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+
+from src.charts import plot_produto_com_volume, plot_spread_area
+from src.data_processing import calcular_indicadores
+
+INDICADORES = ["SMA8", "SMA20", "SMA50", "Bollinger Bands 8"]
+ALTURA_AREA_PX = 440  # altura útil aproximada do painel de preço (height=550)
+
+
+def gerar_ohlc(n_dias: int, seed: int, base: float = 200.0) -> pd.DataFrame:
+    """OHLC diário sintético em dias úteis."""
+    rng = np.random.default_rng(seed)
+    datas = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=n_dias)
+    close = base + np.cumsum(rng.normal(0, 2, n_dias))
+    open_ = close - rng.normal(0, 1.5, n_dias)
+    high = np.maximum(open_, close) + rng.exponential(1.5, n_dias)
+    low = np.minimum(open_, close) - rng.exponential(1.5, n_dias)
+    volume = rng.integers(50, 2000, n_dias).astype(float)
+    return pd.DataFrame(
+        {"open": open_, "high": high, "low": low, "close": close, "volume": volume},
+        index=datas,
+    )
+
+
+def _bytes(fig) -> int:
+    return len(fig.to_json().encode("utf-8"))
+
+
+def _trace(fig, nome: str):
+    """Trace pelo nome (os de indicadores têm o último valor no rótulo)."""
+    return next(
+        t for t in fig.data
+        if t.name == nome or (t.name or "").startswith(f"<b>{nome}</b>")
+    )
+
+
+def _posicoes(trace, categorias: pd.Index) -> np.ndarray:
+    """Posição de cada ponto em categorias: pelo x do ponto ou por x0 + i * dx."""
+    if trace.x is not None:
+        return categorias.get_indexer(list(trace.x)).astype(float)
+    return categorias.get_loc(trace.x0) + np.arange(len(trace.y)) * (trace.dx or 1)
+
+
+def _envoltoria_px(posicoes, n_categorias: int, y, largura: int) -> tuple:
+    """
+    Mín/máx, por coluna de pixel, da linha desenhada no eixo categórico:
+    cada categoria ocupa largura / n_categorias px e a posição p fica em
+    (p + 0.5) desses passos; entre pontos a linha é um segmento, que também
+    conta nas colunas que atravessa (amostrado em cada borda de coluna).
+    """
+    x = (np.asarray(posicoes) + 0.5) * largura / n_categorias
+    y = np.asarray(y, dtype=float)
+    validos = ~np.isnan(y)
+    x, y = x[validos], y[validos]
+
+    bordas = np.arange(1, largura)
+    bordas = bordas[(bordas > x[0]) & (bordas < x[-1])]
+    y_bordas = np.interp(bordas, x, y)
+    # Cada borda fecha uma coluna e abre a seguinte
+    colunas = np.concatenate([np.floor(x), bordas - 1, bordas]).astype(int)
+    valores = np.concatenate([y, y_bordas, y_bordas])
+    grupos = pd.Series(valores).groupby(np.clip(colunas, 0, largura - 1))
+    return grupos.min(), grupos.max()
+
+
+def _erro_px(orig, cats_orig, red, cats_red, largura: int) -> tuple:
+    """
+    Diferença (p95, máx), em pixels verticais, entre as envoltórias por coluna
+    de pixel dos traces orig e red, cada um no seu eixo de categorias.
+    """
+    y_orig = np.asarray(orig.y, dtype=float)
+    faixa = np.nanmax(y_orig) - np.nanmin(y_orig)
+    if faixa == 0:
+        return 0.0, 0.0
+    min_o, max_o = _envoltoria_px(_posicoes(orig, cats_orig), len(cats_orig), orig.y, largura)
+    min_r, max_r = _envoltoria_px(_posicoes(red, cats_red), len(cats_red), red.y, largura)
+    # Os pontos reduzidos não ficam na posição exata do dia original: um
+    # deslocamento horizontal de até 1 px não é erro, só o que falta ou sobra
+    # na vertical. Com um ponto por coluna, um pico cujo mínimo e máximo caem
+    # na mesma coluna se divide entre duas: o limite do máximo cobre esse caso,
+    # o do p95 garante que ele é raro
+    vizinhas = dict(window=3, center=True, min_periods=1)
+    erros = pd.concat([
+        min_r.rolling(**vizinhas).min() - min_o,
+        max_o - max_r.rolling(**vizinhas).max(),
+        min_o.rolling(**vizinhas).min() - min_r,
+        max_r - max_o.rolling(**vizinhas).max(),
+    ], axis=1).max(axis=1).clip(lower=0).dropna().to_numpy()
+    erros = erros / faixa * ALTURA_AREA_PX
+    return float(np.percentile(erros, 95)), float(erros.max())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tamanho e fidelidade das figuras")
+    parser.add_argument("--anos", type=int, default=5)
+    parser.add_argument("--largura", type=int, default=600)
+    parser.add_argument(
+        "--limite-p95", type=float, default=1.0, help="erro p95 máximo aceito (px)"
+    )
+    parser.add_argument(
+        "--limite-max", type=float, default=8.0, help="erro máximo aceito (px)"
+    )
+    parser.add_argument("--saida", default=None, help="anexa o resultado em JSON Lines")
+    args = parser.parse_args()
+
+    n_dias = args.anos * 252
+    df1 = calcular_indicadores(gerar_ohlc(n_dias, 1), INDICADORES)
+    df2 = calcular_indicadores(gerar_ohlc(n_dias, 2, base=180.0), INDICADORES)
+
+    completo = plot_produto_com_volume(df1, INDICADORES)
+    reduzido = plot_produto_com_volume(df1, INDICADORES, largura_px=args.largura)
+    spread_completo = plot_spread_area(df1, df2, "A", "B")
+    spread_reduzido = plot_spread_area(df1, df2, "A", "B", largura_px=args.largura)
+
+    vela_c, vela_r = _trace(completo, "Preço"), _trace(reduzido, "Preço")
+    vol_c, vol_r = _trace(completo, "Volume"), _trace(reduzido, "Volume")
+    envoltoria_ok = (
+        max(vela_c.high) == max(vela_r.high)
+        and min(vela_c.low) == min(vela_r.low)
+        and vela_c.open[0] == vela_r.open[0]
+        and vela_c.close[-1] == vela_r.close[-1]
+        and sum(vol_c.y) == sum(vol_r.y)
+        # Barras de volume (x0/dx) uma por candle, a partir da 1ª categoria
+        and len(vol_r.y) == len(vela_r.x)
+        and vol_r.x0 == vela_r.x[0]
+    )
+
+    # Categorias de cada eixo: datas dos candles / dos pontos do spread
+    cats_c, cats_r = pd.Index(vela_c.x), pd.Index(vela_r.x)
+    erros = {
+        ind: _erro_px(_trace(completo, ind), cats_c, _trace(reduzido, ind), cats_r, args.largura)
+        for ind in ("SMA8", "SMA20", "SMA50", "BB Sup", "BB Mid", "BB Inf")
+    }
+    linha_c, linha_r = spread_completo.data[0], spread_reduzido.data[0]
+    erros["Spread"] = _erro_px(
+        linha_c, pd.Index(linha_c.x), linha_r, pd.Index(linha_r.x), args.largura
+    )
+    # Legenda e anotação mostram o último valor real, não o da última faixa
+    rotulos_ok = [t.name for t in completo.data] == [t.name for t in reduzido.data] and (
+        spread_completo.layout.annotations[0].text == spread_reduzido.layout.annotations[0].text
+    )
+    ok = envoltoria_ok and rotulos_ok and all(
+        p95 <= args.limite_p95 and maximo <= args.limite_max for p95, maximo in erros.values()
+    )
+
+    resultado = {
+        "dias": n_dias,
+        "largura_px": args.largura,
+        "candles": [len(vela_c.x), len(vela_r.x)],
+        "produto_bytes": [_bytes(completo), _bytes(reduzido)],
+        "spread_bytes": [_bytes(spread_completo), _bytes(spread_reduzido)],
+        "pontos_spread": [len(linha_c.y), len(linha_r.y)],
+        "envoltoria_ok": envoltoria_ok,
+        "rotulos_ok": rotulos_ok,
+        "erro_px_p95_max": {k: [round(e, 2) for e in v] for k, v in erros.items()},
+        "limite_px_p95_max": [args.limite_p95, args.limite_max],
+        "ok": ok,
+    }
+
+    print(f"{n_dias} dias, largura {args.largura}px")
+    print(f"  candles:  {len(vela_c.x)} -> {len(vela_r.x)}")
+    for nome, (antes, depois) in (
+        ("produto", resultado["produto_bytes"]),
+        ("spread", resultado["spread_bytes"]),
+    ):
+        print(f"  {nome:8}: {antes:>9,} -> {depois:>9,} bytes "
+              f"({100 * (1 - depois / antes):.0f}% menor)")
+    print(f"  pontos do spread: {len(linha_c.y)} -> {len(linha_r.y)}")
+    print(f"  envoltória OHLC e volume preservados: {envoltoria_ok}")
+    print(f"  legenda e anotação com o último valor real: {rotulos_ok}")
+    print(f"  erro p95 / máx (px), limite {args.limite_p95} / {args.limite_max}:")
+    for nome, (p95, maximo) in erros.items():
+        estourou = p95 > args.limite_p95 or maximo > args.limite_max
+        print(f"    {nome:7} {p95:6.2f} / {maximo:6.2f}{'  FALHOU' if estourou else ''}")
+    print("  OK" if ok else "  FALHOU")
+
+    if args.saida:
+        with open(args.saida, "a", encoding="utf-8") as f:
+            f.write(json.dumps(resultado) + "\n")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+Teste de carga do dashboard com N sessões simultâneas num único servidor.
+
+Para cada N sobe um `streamlit run app.py` (apontado para o servidor local de
+bench/bbce_stub.py) e abre N conexões WebSocket, cada uma se comportando como
+uma aba do navegador: login, conexão à BBCE e reruns alterando período e
+indicadores. Todas as sessões dividem o mesmo processo, como em produção: o
+GIL, os caches de st.cache_data e a memória. As sessões esperam numa barreira
+antes dos reruns para disputarem o servidor ao mesmo tempo.
+
+A latência de um rerun vai do envio dos widgets até o fim da execução do
+script (script_finished). RSS e CPU são medidos uma vez, no processo do
+servidor (Linux, via /proc): a linha de base é o servidor após uma execução
+da tela de login (bibliotecas e app importados) e a memória por sessão é o
+crescimento do RSS após a carga dividido por N, contando os caches
+compartilhados. A memória em
+session_state e nos caches vem do painel "🧠 Memória" do próprio app.
+Os resultados são anexados em JSON Lines para comparar versões.
+
+Uso:
+    python -m bench.load_test --sessoes 1 2 4 8 --reruns 10 --saida bench_results.jsonl
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tornado.websocket import websocket_connect
+
+RAIZ = Path(__file__).resolve().parent.parent
+APP = RAIZ / "app.py"
+LOGIN = "bench"
+SENHA = "bench"
+PERIODOS = ["1M", "2M", "3M", "6M", "YTD", "ALL"]
+INDICADORES = ["SMA8", "SMA20", "SMA50", "Bollinger Bands 8", "Volume Profile"]
+
+
+def _recursos(pid: int) -> tuple:
+    """(RSS em MB, tempo de CPU em s) do processo, lidos de /proc."""
+    with open(f"/proc/{pid}/statm") as f:
+        rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    with open(f"/proc/{pid}/stat") as f:
+        # Campos após o nome do processo (que pode ter espaços): utime e stime são 14º e 15º
+        campos = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(campos[11]) + int(campos[12])) / os.sysconf("SC_CLK_TCK")
+    return rss, cpu
+
+
+def _versao() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], cwd=RAIZ, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecida"
+
+
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def iniciar_servidor(url_stub: str, timeout: float) -> tuple:
+    """
+    Sobe o app com credenciais fictícias e a URL do stub e espera o health
+    check. Retorna (processo, porta).
+    """
+    porta = _porta_livre()
+    env = os.environ | {
+        "DASHBOARD_LOGIN": LOGIN,
+        "DASHBOARD_PASSWORD": SENHA,
+        "BBCE_COMPANY_CODE": "1",
+        "BBCE_EMAIL": "bench@example.com",
+        "BBCE_PASSWORD": "bench",
+        "BBCE_API_KEY": "bench",
+        "BBCE_API_URL": url_stub,
+    }
+    processo = subprocess.Popen(
+        [
+            sys.executable, "-m", "streamlit", "run", str(APP),
+            "--server.headless=true",
+            f"--server.port={porta}",
+            "--server.fileWatcherType=none",
+            "--browser.gatherUsageStats=false",
+        ],
+        cwd=RAIZ,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f"O servidor terminou com código {processo.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{porta}/_stcore/health", timeout=1):
+                return processo, porta
+        except OSError:
+            time.sleep(0.2)
+    processo.kill()
+    raise RuntimeError("O servidor não respondeu ao health check")
+
+
+class Sessao:
+    """
+    Cliente mínimo do protocolo do Streamlit (uma aba do navegador): envia
+    reruns com o estado dos widgets e lê as mensagens até o fim do script.
+    """
+
+    def __init__(self, porta: int, timeout: float):
+        self.url = f"ws://127.0.0.1:{porta}/_stcore/stream"
+        self.timeout = timeout
+        self.ws = None
+        self.widgets = {}  # tipo do elemento -> ids, na ordem em que apareceram
+        self.cache = {}  # hash -> ForwardMsg, para mensagens enviadas só por referência
+        self.erros = []
+        self.memoria = None  # tabela do painel "🧠 Memória"
+
+    async def conectar(self) -> None:
+        self.ws = await websocket_connect(self.url)
+
+    async def rodar(self, estados: list | None = None) -> float:
+        """Executa o script com os widgets dados e retorna a duração em ms."""
+        msg = BackMsg()
+        msg.rerun_script.widget_states.widgets.extend(estados or [])
+        self.widgets.clear()
+        inicio = time.perf_counter()
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+        await asyncio.wait_for(self._ate_fim(), self.timeout)
+        return (time.perf_counter() - inicio) * 1000
+
+    async def _ate_fim(self) -> None:
+        while True:
+            bruto = await self.ws.read_message()
+            if bruto is None:
+                raise ConnectionError("O servidor fechou a conexão")
+            fwd = ForwardMsg()
+            fwd.ParseFromString(bruto)
+            if fwd.WhichOneof("type") == "ref_hash":
+                fwd = self.cache[fwd.ref_hash]
+            elif fwd.metadata.cacheable:
+                self.cache[fwd.hash] = fwd
+            if fwd.WhichOneof("type") == "delta":
+                self._registrar(fwd.delta)
+            elif fwd.WhichOneof("type") == "script_finished":
+                # Reruns pedidos pelo script (st.rerun) e de fragments não encerram o ciclo
+                if fwd.script_finished == ForwardMsg.FINISHED_SUCCESSFULLY:
+                    return
+                if fwd.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    raise RuntimeError("Erro de compilação no script")
+
+    def _registrar(self, delta) -> None:
+        if delta.WhichOneof("type") != "new_element":
+            return
+        elemento = delta.new_element
+        tipo = elemento.WhichOneof("type")
+        if tipo == "exception":
+            self.erros.append(elemento.exception.message)
+        elif tipo in ("text_input", "button", "radio", "multiselect"):
+            self.widgets.setdefault(tipo, []).append(getattr(elemento, tipo).id)
+        elif tipo == "arrow_data_frame" and "Ociosa" in elemento.arrow_data_frame.columns:
+            tabela = pa.ipc.open_stream(io.BytesIO(elemento.arrow_data_frame.data)).read_all()
+            self.memoria = tabela.to_pandas()
+
+    def widget(self, tipo: str, chave: str | None = None) -> str:
+        """Id do primeiro widget do tipo (ou do que tem a chave) na última execução."""
+        return next(i for i in self.widgets[tipo] if chave is None or i.endswith(chave))
+
+
+def _estado(widget_id: str, **valor) -> WidgetState:
+    estado = WidgetState(id=widget_id)
+    for campo, v in valor.items():
+        if isinstance(v, list):
+            getattr(estado, campo).data.extend(v)
+        else:
+            setattr(estado, campo, v)
+    return estado
+
+
+async def _executar_sessao(
+    porta: int, n_reruns: int, seed: int, barreira: asyncio.Barrier, timeout: float
+) -> dict:
+    """Fluxo de uma sessão: login, carga inicial e reruns após a barreira."""
+    rng = random.Random(seed)
+    sessao = Sessao(porta, timeout)
+    await sessao.conectar()
+    await sessao.rodar()
+
+    campos = sessao.widgets["text_input"]
+    carga_ms = await sessao.rodar([
+        _estado(campos[0], string_value=LOGIN),
+        _estado(campos[1], string_value=SENHA),
+        _estado(sessao.widget("button"), trigger_value=True),
+    ])  # login + conexão à BBCE + carga inicial
+
+    await barreira.wait()
+    latencias = []
+    for _ in range(n_reruns):
+        periodo = _estado(
+            sessao.widget("radio", "periodo_main"),
+            int_value=PERIODOS.index(rng.choice(PERIODOS)),
+        )
+        escolhidos = rng.sample(range(len(INDICADORES)), rng.randint(1, len(INDICADORES)))
+        indicadores = _estado(
+            sessao.widget("multiselect", "indicadores_main"), int_array_value=sorted(escolhidos)
+        )
+        latencias.append(await sessao.rodar([periodo, indicadores]))
+    sessao.ws.close()
+    return {
+        "erros": sessao.erros,
+        "carga_ms": carga_ms,
+        "latencias_ms": latencias,
+        "memoria": sessao.memoria,
+    }
+
+
+async def _aquecer(porta: int, timeout: float) -> None:
+    """Uma execução da tela de login, para a linha de base já ter o app importado."""
+    sessao = Sessao(porta, timeout)
+    await sessao.conectar()
+    await sessao.rodar()
+    sessao.ws.close()
+
+
+async def _rodada(porta: int, n_sessoes: int, n_reruns: int, timeout: float, pid: int):
+    barreira = asyncio.Barrier(n_sessoes + 1)
+    tarefas = [
+        asyncio.create_task(_executar_sessao(porta, n_reruns, i, barreira, timeout))
+        for i in range(n_sessoes)
+    ]
+    espera = asyncio.create_task(barreira.wait())
+    feitos, _ = await asyncio.wait([espera, *tarefas], return_when=asyncio.FIRST_COMPLETED)
+    if espera not in feitos:
+        # Alguma sessão terminou (com falha) antes da barreira: libera as demais
+        espera.cancel()
+        await barreira.abort()
+    antes = _recursos(pid)
+    inicio = time.perf_counter()
+    resultados = await asyncio.gather(*tarefas, return_exceptions=True)
+    parede = time.perf_counter() - inicio
+    return resultados, antes, _recursos(pid), parede
+
+
+def medir(url_stub: str, n_sessoes: int, n_reruns: int, timeout: float) -> dict:
+    """Roda n_sessoes simultâneas num servidor novo e agrega as métricas da rodada."""
+    processo, porta = iniciar_servidor(url_stub, timeout)
+    try:
+        asyncio.run(_aquecer(porta, timeout))
+        rss_base, _ = _recursos(processo.pid)
+        recebidos, antes, depois, parede = asyncio.run(
+            _rodada(porta, n_sessoes, n_reruns, timeout, processo.pid)
+        )
+    finally:
+        processo.terminate()
+        processo.wait(timeout=10)
+
+    resultados = [r for r in recebidos if not isinstance(r, BaseException)]
+    if not resultados:
+        falhas = [f"{type(r).__name__}: {r}" for r in recebidos]
+        raise RuntimeError(f"Nenhuma sessão concluiu com {n_sessoes} sessões: {falhas}")
+
+    latencias = np.concatenate([r["latencias_ms"] for r in resultados])
+    # Painel de memória da última sessão a terminar: vê todas as sessões do processo
+    memoria = next(
+        (r["memoria"] for r in reversed(resultados) if r["memoria"] is not None), None
+    )
+    if memoria is not None:
+        compartilhado = memoria["sessao"] == "compartilhado"
+        # Inclui a sessão de aquecimento, que só tem o estado da tela de login
+        state_mb = memoria.loc[~compartilhado, "MB"].sum() / n_sessoes
+        cache_mb = memoria.loc[compartilhado, "MB"].sum()
+    else:
+        state_mb = cache_mb = np.nan
+
+    return {
+        "versao": _versao(),
+        "executado_em": datetime.now().isoformat(timespec="seconds"),
+        "isolamento": "servidor_unico",
+        "sessoes": n_sessoes,
+        "sessoes_concluidas": len(resultados),
+        "reruns_por_sessao": n_reruns,
+        "erros": sum(len(r["erros"]) for r in resultados)
+        + len(recebidos) - len(resultados),
+        "carga_inicial_ms_p50": float(np.median([r["carga_ms"] for r in resultados])),
+        "rerun_ms_p50": float(np.percentile(latencias, 50)),
+        "rerun_ms_p95": float(np.percentile(latencias, 95)),
+        "rerun_ms_p99": float(np.percentile(latencias, 99)),
+        "rss_mb_base": rss_base,
+        "rss_mb_processo": depois[0],
+        "rss_mb_por_sessao": (depois[0] - rss_base) / n_sessoes,
+        "session_state_mb_por_sessao": float(state_mb),
+        "cache_mb": float(cache_mb),
+        "cpu_pct": 100 * (depois[1] - antes[1]) / parede if parede > 0 else 0.0,
+        "cpus_disponiveis": os.cpu_count(),
+        "duracao_s": parede,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do dashboard")
+    parser.add_argument("--sessoes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--reruns", type=int, default=10)
+    parser.add_argument("--produtos", type=int, default=40)
+    parser.add_argument("--deals-por-dia", type=int, default=300)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--saida", default="bench_results.jsonl")
+    args = parser.parse_args()
+
+    from bench.bbce_stub import iniciar_stub
+
+    server = iniciar_stub(0, args.produtos, args.deals_por_dia)
+    url_stub = f"http://127.0.0.1:{server.server_port}/"
+
+    print(f"{'sessões':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'RSS MB':>8} "
+          f"{'MB/sessão':>10} {'state MB':>9} {'cache MB':>9} {'CPU %':>7} {'erros':>6}")
+    with open(args.saida, "a", encoding="utf-8") as f:
+        for n in args.sessoes:
+            r = medir(url_stub, n, args.reruns, args.timeout)
+            f.write(json.dumps(r) + "\n")
+            f.flush()
+            print(f"{n:>8} {r['rerun_ms_p50']:>9.1f} {r['rerun_ms_p95']:>9.1f} "
+                  f"{r['rerun_ms_p99']:>9.1f} {r['rss_mb_processo']:>8.1f} "
+                  f"{r['rss_mb_por_sessao']:>10.1f} {r['session_state_mb_por_sessao']:>9.2f} "
+                  f"{r['cache_mb']:>9.2f} {r['cpu_pct']:>7.1f} {r['erros']:>6}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
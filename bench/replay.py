@@ -0,0 +1,377 @@
+"""
+Replay determinístico de deals pelo caminho real de atualização incremental.
+
+Entrega um histórico de deals (gravado da API em JSON ou sintético de
+bench/bbce_stub.py) num relógio simulado e chama src.bbce_api.refresh_deals
+a cada intervalo, com st.session_state (modo bare) como o de uma sessão.
+Só a API é simulada: load_deals_if_changed devolve o que a BBCE devolveria
+naquele instante para o período pedido, com o hash do corpo. Passam pelo
+caminho real o curto-circuito por hash, a regra da janela vazia, o
+filtro/merge e a retenção (_reter). Depois de cada atualização são refeitos
+OHLC/indicadores/VWAP dos produtos exibidos, as figuras e o cubo diário.
+
+O fluxo inclui negócios lançados com atraso (createdAt no passado),
+cancelamentos posteriores (status Ativo → Cancelado) e respostas vazias.
+Eventos com createdAt anterior à janela da atualização não entram até o
+próximo login; o replay os conta como perdidos, e só então o estado final
+difere da reconstrução completa.
+
+Reporta deals/s, latência por atualização (total e por etapa), crescimento de
+memória e a conferência com uma carga completa do fluxo final (novo login).
+
+Uso:
+    python -m bench.replay --dias 7 --intervalo-min 60
+    python -m bench.replay --arquivo deals.json --atraso-max-dias 10
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import src.bbce_api as bbce_api
+from bench.bbce_stub import gerar_deals
+from src.bbce_api import JANELA_REFRESH_DIAS, parse_deals, refresh_deals
+from src.charts import plot_produto_com_volume, plot_spread_area
+from src.data_processing import (
+    build_daily_cube,
+    build_ohlc,
+    calcular_indicadores,
+    calcular_indicadores_lote,
+    calcular_vwap,
+)
+from src.retention import barras_do_produto
+
+INDICADORES = ["SMA8", "SMA20", "SMA50", "Bollinger Bands 8"]
+NS_POR_DIA = 86_400 * 10**9
+NUNCA = np.iinfo(np.int64).max
+
+
+def _rss_mb() -> float:
+    """RSS atual do processo em MB (Linux); pico de RSS nos demais sistemas."""
+    try:
+        with open("/proc/self/statm") as f:
+            paginas = int(f.read().split()[1])
+        return paginas * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+class _Fluxo:
+    """
+    Deals com o instante em que a API passa a mostrá-los (visivel) e, se
+    cancelados, o instante do cancelamento. O histórico é deslocado em dias
+    inteiros para terminar hoje: a retenção corta pelo relógio real.
+    """
+
+    def __init__(self, deals: list, atrasados: float, cancelados: float,
+                 atraso_max_dias: float, seed: int = 7):
+        rng = np.random.default_rng(seed)
+        deals = sorted(deals, key=lambda d: d["createdAt"])
+        criado = pd.to_datetime([d["createdAt"] for d in deals])
+        deslocamento = pd.Timestamp.now().normalize() - criado[-1].normalize()
+        criado = criado + deslocamento
+        formato = "%Y-%m-%dT%H:%M:%S%z" if criado.tz is not None else "%Y-%m-%dT%H:%M:%S"
+        self.deals = [
+            d | {"createdAt": c} for d, c in zip(deals, criado.strftime(formato))
+        ]
+        self.criado = criado.tz_localize(None).asi8 if criado.tz is not None else criado.asi8
+        self.ativo = np.array([d.get("status") == "Ativo" for d in deals])
+
+        n = len(deals)
+        atraso_max = int(atraso_max_dias * NS_POR_DIA)
+        atraso = np.where(rng.random(n) < atrasados, rng.integers(0, atraso_max + 1, n), 0)
+        self.visivel = self.criado + atraso
+        cancela = (rng.random(n) < cancelados) & self.ativo
+        self.cancelado = np.where(
+            cancela, self.visivel + rng.integers(0, atraso_max + 1, n), NUNCA
+        )
+        self.falhar = False
+
+    def eventos(self) -> np.ndarray:
+        """Instantes em que a resposta da API muda (publicação ou cancelamento)."""
+        return np.concatenate([self.visivel, self.cancelado[self.cancelado < NUNCA]])
+
+    def responder(self, agora: int, data_inicio: str) -> tuple:
+        """Deals do período a partir de data_inicio vistos pela API em `agora`."""
+        if self.falhar:
+            return np.array([], dtype=np.int64), np.array([], dtype=bool)
+        selecao = np.flatnonzero(
+            (self.visivel <= agora) & (self.criado >= pd.Timestamp(data_inicio).value)
+        )
+        return selecao, self.cancelado[selecao] <= agora
+
+    def load_deals_if_changed(self, agora: int):
+        """Substituto de bbce_api.load_deals_if_changed no instante `agora`."""
+
+        def carregar(token, api_key, data_inicio, data_fim, hash_anterior=None):
+            selecao, cancelado = self.responder(agora, data_inicio)
+            digest = hashlib.sha256(selecao.tobytes() + cancelado.tobytes()).hexdigest()
+            if hash_anterior is not None and digest == hash_anterior:
+                return None, digest
+            data = [
+                self.deals[i] | {"status": "Cancelado"} if c else self.deals[i]
+                for i, c in zip(selecao.tolist(), cancelado.tolist())
+            ]
+            return parse_deals(data), digest
+
+        return carregar
+
+
+def _pipeline(df: pd.DataFrame, agregados, n_produtos: int, tempos: dict) -> dict:
+    """Recalcula o que o dashboard deriva de df e acumula o tempo de cada etapa."""
+    inicio = time.perf_counter()
+    volume = df.groupby("productId")["quantity"].sum().sort_values(ascending=False)
+    produtos = volume.index[:n_produtos].tolist()
+    ohlc, vwap = {}, {}
+    for pid in produtos:
+        df_raw = df[df["productId"] == pid]
+        antigas = barras_do_produto(agregados, pid)
+        vwap[pid] = calcular_vwap(df_raw, antigas)
+        ohlc[pid] = calcular_indicadores(build_ohlc(df_raw, antigas), INDICADORES)
+    tempos["ohlc_indicadores"] += time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    for pid in produtos:
+        plot_produto_com_volume(ohlc[pid], INDICADORES, largura_px=600)
+    if len(produtos) >= 2:
+        plot_spread_area(ohlc[produtos[0]], ohlc[produtos[1]], "A", "B", largura_px=600)
+    tempos["figuras"] += time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    cubo = build_daily_cube(df)
+    lote = calcular_indicadores_lote(cubo)
+    tempos["cubo_lote"] += time.perf_counter() - inicio
+
+    return {"ohlc": ohlc, "vwap": vwap, "cubo": cubo, "lote": lote}
+
+
+def _resumo(erro: AssertionError) -> str:
+    """Primeira linha da mensagem do pandas (o resto lista os valores)."""
+    return next((linha for linha in str(erro).splitlines() if linha.strip()), "")
+
+
+def _conferir(estado: dict, referencia: dict) -> list:
+    """Lista as diferenças entre o estado do replay e a reconstrução completa."""
+    diferencas = []
+    for chave in ("df", "agregados"):
+        try:
+            pd.testing.assert_frame_equal(estado[chave], referencia[chave], check_exact=True)
+        except AssertionError as e:
+            diferencas.append(f"{chave}: {_resumo(e)}")
+
+    for pid, esperado in referencia["ohlc"].items():
+        try:
+            pd.testing.assert_frame_equal(estado["ohlc"][pid], esperado, check_exact=True)
+            pd.testing.assert_series_equal(
+                estado["vwap"][pid], referencia["vwap"][pid], check_exact=True
+            )
+        except AssertionError as e:
+            diferencas.append(f"produto {pid}: {_resumo(e)}")
+        except KeyError:
+            diferencas.append(f"produto {pid}: ausente no replay")
+
+    cubo, cubo_ref = estado["cubo"], referencia["cubo"]
+    iguais = {
+        "produtos": np.array_equal(cubo["produtos"], cubo_ref["produtos"]),
+        # NaT nunca é igual a NaT; compara a representação inteira
+        "datas": np.array_equal(cubo["datas"].view("i8"), cubo_ref["datas"].view("i8")),
+    }
+    for campo in ("open", "high", "low", "close", "volume"):
+        iguais[campo] = np.array_equal(cubo[campo], cubo_ref[campo], equal_nan=True)
+    diferencas += [f"cubo[{campo}] diferente" for campo, ok in iguais.items() if not ok]
+    for nome, valores in referencia["lote"].items():
+        if not np.array_equal(estado["lote"][nome], valores, equal_nan=True):
+            diferencas.append(f"lote[{nome}] diferente")
+    return diferencas
+
+
+def _nova_sessao(arquivo_agregados: str) -> None:
+    """Sessão recém-logada, sem deals, com as barras agregadas em arquivo próprio."""
+    st.session_state.clear()
+    st.session_state.token = "replay"
+    st.session_state.api_key = "replay"
+    os.environ["HISTORICO_AGREGADO_FILE"] = arquivo_agregados
+
+
+def replay(
+    fluxo: _Fluxo,
+    dias: float,
+    intervalo_min: float,
+    falhas: float = 0.0,
+    n_produtos: int = 2,
+    velocidade: float = 0.0,
+) -> dict:
+    """
+    Carrega o fluxo até `dias` antes do último evento (como no login) e então
+    chama refresh_deals a cada intervalo_min do relógio simulado até o fim.
+    falhas é a fração de atualizações em que a API responde vazio; velocidade
+    é o fator de aceleração do relógio (0 = sem espera).
+    """
+    rng = np.random.default_rng(11)
+    # Barras agregadas e alertas do replay não tocam os arquivos do app
+    pasta = tempfile.mkdtemp(prefix="replay_")
+    os.environ["ALERTS_FILE"] = os.path.join(pasta, "alertas.jsonl")
+    original = bbce_api.load_deals_if_changed
+    tempos = dict.fromkeys(("refresh", "ohlc_indicadores", "figuras", "cubo_lote"), 0.0)
+    fim = int(fluxo.eventos().max())
+    passo = int(intervalo_min * 60 * 10**9)
+    relogio = np.arange(fim - int(dias * NS_POR_DIA), fim + passo, passo)
+    relogio[-1] = fim
+    contagem = dict.fromkeys(("ok", "sem_mudanca", "vazias", "perdidos"), 0)
+
+    try:
+        _nova_sessao(os.path.join(pasta, "sessao.pkl"))
+        bbce_api.load_deals_if_changed = fluxo.load_deals_if_changed(int(relogio[0]))
+        refresh_deals()
+        rss_inicial = _rss_mb()
+        pendentes = fluxo.visivel > relogio[0]
+        eventos_cancelamento = fluxo.cancelado > relogio[0]
+
+        latencias, rss = [], []
+        inicio_total = time.perf_counter()
+        for anterior, agora in zip(relogio[:-1], relogio[1:]):
+            if velocidade > 0:
+                time.sleep((agora - anterior) / 1e9 / velocidade)
+            fluxo.falhar = rng.random() < falhas
+            bbce_api.load_deals_if_changed = fluxo.load_deals_if_changed(int(agora))
+            hash_antes = st.session_state.get("deals_hash")
+            desde = (
+                st.session_state.df.index.max().normalize()
+                - pd.Timedelta(days=JANELA_REFRESH_DIAS)
+            ).value
+
+            t0 = time.perf_counter()
+            ok = refresh_deals()
+            t1 = time.perf_counter()
+            if not ok:
+                contagem["vazias"] += 1
+                continue
+            if st.session_state.deals_hash == hash_antes:
+                contagem["sem_mudanca"] += 1
+                continue
+            contagem["ok"] += 1
+            # Eventos já vistos pela API: fora da janela não chegam à sessão
+            for marcas, instantes in ((pendentes, fluxo.visivel),
+                                      (eventos_cancelamento, fluxo.cancelado)):
+                vistos = marcas & (instantes <= agora)
+                contagem["perdidos"] += int((vistos & (fluxo.criado < desde)).sum())
+                marcas &= ~vistos
+            _pipeline(
+                st.session_state.df, st.session_state.agregados, n_produtos, tempos
+            )
+            tempos["refresh"] += t1 - t0
+            latencias.append((time.perf_counter() - t0) * 1000)
+            rss.append(_rss_mb())
+        duracao = time.perf_counter() - inicio_total
+
+        fluxo.falhar = False
+        estado = _pipeline(
+            st.session_state.df, st.session_state.agregados, n_produtos,
+            dict.fromkeys(tempos, 0.0),
+        )
+        estado["df"], estado["agregados"] = st.session_state.df, st.session_state.agregados
+
+        # Reconstrução completa: novo login após o último evento, sem barras em disco
+        _nova_sessao(os.path.join(pasta, "referencia.pkl"))
+        refresh_deals()
+        referencia = _pipeline(
+            st.session_state.df, st.session_state.agregados, n_produtos,
+            dict.fromkeys(tempos, 0.0),
+        )
+        referencia["df"] = st.session_state.df
+        referencia["agregados"] = st.session_state.agregados
+        diferencas = _conferir(estado, referencia)
+    finally:
+        bbce_api.load_deals_if_changed = original
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    n_replay = int((fluxo.visivel > relogio[0]).sum())
+    latencias = np.array(latencias) if latencias else np.zeros(1)
+    return {
+        "deals": len(fluxo.deals),
+        "deals_replay": n_replay,
+        "atualizacoes": len(relogio) - 1,
+        "com_mudanca": contagem["ok"],
+        "sem_mudanca": contagem["sem_mudanca"],
+        "respostas_vazias": contagem["vazias"],
+        "eventos_perdidos": contagem["perdidos"],
+        "deals_por_s": n_replay / duracao if duracao > 0 else float("inf"),
+        "atualizacao_ms_p50": float(np.percentile(latencias, 50)),
+        "atualizacao_ms_p95": float(np.percentile(latencias, 95)),
+        "atualizacao_ms_max": float(latencias.max()),
+        "etapas_ms_por_atualizacao": {
+            k: 1000 * v / max(contagem["ok"], 1) for k, v in tempos.items()
+        },
+        "rss_inicial_mb": rss_inicial,
+        "rss_crescimento_mb": (max(rss) if rss else rss_inicial) - rss_inicial,
+        "igual_reconstrucao": not diferencas,
+        "diferencas": diferencas[:10],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay de deals pelo refresh incremental")
+    parser.add_argument("--arquivo", help="JSON com a lista de deals da API (all-deals/report)")
+    parser.add_argument("--produtos", type=int, default=40, help="produtos no histórico sintético")
+    parser.add_argument("--deals-por-dia", type=int, default=300)
+    parser.add_argument("--data-inicio", default="2025-01-01")
+    parser.add_argument("--dias", type=float, default=7, help="dias finais reproduzidos")
+    parser.add_argument("--intervalo-min", type=float, default=60,
+                        help="intervalo entre atualizações no relógio simulado")
+    parser.add_argument("--atrasados", type=float, default=0.02,
+                        help="fração de deals publicados com atraso")
+    parser.add_argument("--cancelados", type=float, default=0.01,
+                        help="fração de deals cancelados depois de publicados")
+    parser.add_argument("--atraso-max-dias", type=float, default=2,
+                        help="atraso máximo de publicação e de cancelamento")
+    parser.add_argument("--falhas", type=float, default=0.05,
+                        help="fração de atualizações com resposta vazia")
+    parser.add_argument("--velocidade", type=float, default=0.0,
+                        help="aceleração do relógio (ex.: 3600 = 1 h por segundo); 0 = sem espera")
+    parser.add_argument("--exibidos", type=int, default=2, help="produtos com gráficos por lote")
+    parser.add_argument("--saida", default=None, help="anexa o resultado em JSON Lines")
+    args = parser.parse_args()
+
+    # st.session_state fora do servidor (modo bare) avisa a cada acesso
+    for nome in ("scriptrunner_utils.script_run_context", "state.session_state_proxy"):
+        logging.getLogger(f"streamlit.runtime.{nome}").setLevel(logging.ERROR)
+    if args.arquivo:
+        with open(args.arquivo, encoding="utf-8") as f:
+            deals = json.load(f)
+    else:
+        deals = gerar_deals(args.produtos, args.deals_por_dia, args.data_inicio)
+    fluxo = _Fluxo(deals, args.atrasados, args.cancelados, args.atraso_max_dias)
+    os.environ["HISTORICO_INICIO"] = pd.Timestamp(fluxo.criado.min()).strftime("%Y-%m-%d")
+
+    r = replay(fluxo, args.dias, args.intervalo_min, args.falhas, args.exibidos,
+               args.velocidade)
+    print(f"{r['deals_replay']:,} de {r['deals']:,} deals em {r['atualizacoes']} atualizações "
+          f"({r['com_mudanca']} com mudança, {r['sem_mudanca']} sem, "
+          f"{r['respostas_vazias']} vazias)")
+    print(f"  {r['deals_por_s']:,.0f} deals/s; atualização p50 {r['atualizacao_ms_p50']:.1f} ms, "
+          f"p95 {r['atualizacao_ms_p95']:.1f} ms, máx {r['atualizacao_ms_max']:.1f} ms")
+    print("  por etapa (ms/atualização): "
+          + ", ".join(f"{k} {v:.1f}" for k, v in r["etapas_ms_por_atualizacao"].items()))
+    print(f"  memória: {r['rss_inicial_mb']:.0f} MB + {r['rss_crescimento_mb']:.1f} MB")
+    print(f"  eventos fora da janela (só no próximo login): {r['eventos_perdidos']}")
+    print(f"  igual à reconstrução completa: {r['igual_reconstrucao']}")
+    for d in r["diferencas"]:
+        print(f"    {d}")
+
+    if args.saida:
+        with open(args.saida, "a", encoding="utf-8") as f:
+            f.write(json.dumps(r) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from src.data_processing import build_daily_cube, calcular_indicadores_lote
+
+LIMITE_MS = 50.0
+
+# Séries disponíveis no cubo de indicadores (primeiro eixo do array empilhado)
+SERIES = ("close", "SMA8", "SMA20", "BB_upper", "BB_lower")
+_CLOSE, _SMA8, _SMA20, _BB_UPPER, _BB_LOWER = range(len(SERIES))
+
+# tipo -> (série esquerda, série direita ou None para valor fixo, sobe?, usa produto B?)
+TIPOS_REGRA = {
+    "preco_acima": (_CLOSE, None, True, False),
+    "preco_abaixo": (_CLOSE, None, False, False),
+    "bb_superior": (_CLOSE, _BB_UPPER, True, False),
+    "bb_inferior": (_CLOSE, _BB_LOWER, False, False),
+    "sma8_cruza_acima_sma20": (_SMA8, _SMA20, True, False),
+    "sma8_cruza_abaixo_sma20": (_SMA8, _SMA20, False, False),
+    "spread_acima": (_CLOSE, None, True, True),
+    "spread_abaixo": (_CLOSE, None, False, True),
+}
+
+# (regra, data) já gravados em ALERTS_FILE, compartilhados por todas as sessões
+# do processo; o arquivo é lido de forma incremental a partir de `posicao`
+_gravados = {"arquivo": None, "posicao": 0, "chaves": set()}
+_gravados_lock = threading.Lock()
+# Serializa a atribuição de ids (leitura + regravação do arquivo de regras)
+_regras_lock = threading.Lock()
+
+
+def _arquivo_regras() -> str:
+    return os.getenv("ALERTS_RULES_FILE", "alert_rules.json")
+
+
+def _arquivo_alertas() -> str:
+    return os.getenv("ALERTS_FILE", "alerts.jsonl")
+
+
+def carregar_regras() -> list:
+    """
+    Lê a lista de regras de alerta do arquivo JSON (lista vazia se ausente).
+    Regras sem id, ou com id repetido, recebem um novo e o arquivo é regravado:
+    o id identifica a regra na deduplicação dos alertas, então não pode
+    depender da posição na lista.
+    """
+    with _regras_lock:
+        try:
+            with open(_arquivo_regras(), encoding="utf-8") as f:
+                regras = json.load(f)
+        except (OSError, ValueError):
+            return []
+
+        proximo = max((r["id"] for r in regras if type(r.get("id")) is int), default=0) + 1
+        vistos, alterado = set(), False
+        for regra in regras:
+            if regra.get("id") is None or regra["id"] in vistos:
+                regra["id"], proximo, alterado = proximo, proximo + 1, True
+            vistos.add(regra["id"])
+        if alterado:
+            salvar_regras(regras)
+    return [r for r in regras if r.get("tipo") in TIPOS_REGRA]
+
+
+def salvar_regras(regras: list) -> None:
+    """Grava a lista de regras de alerta no arquivo JSON."""
+    with open(_arquivo_regras(), "w", encoding="utf-8") as f:
+        # IDs de produto podem vir como inteiros do NumPy
+        json.dump(regras, f, ensure_ascii=False, indent=2, default=lambda o: o.item())
+
+
+def _chaves_gravadas() -> set:
+    """
+    Pares (regra, data) já presentes em ALERTS_FILE. Lê só as linhas
+    acrescentadas desde a última chamada (relê tudo se o arquivo encolheu).
+    Chamar com _gravados_lock.
+    """
+    arquivo = _arquivo_alertas()
+    try:
+        tamanho = os.path.getsize(arquivo)
+    except OSError:
+        tamanho = 0
+    if _gravados["arquivo"] != arquivo or tamanho < _gravados["posicao"]:
+        _gravados.update(arquivo=arquivo, posicao=0, chaves=set())
+    if tamanho > _gravados["posicao"]:
+        with open(arquivo, "rb") as f:
+            f.seek(_gravados["posicao"])
+            bloco = f.read()
+        completas = bloco.rfind(b"\n") + 1  # ignora uma linha ainda sendo escrita
+        for linha in bloco[:completas].splitlines():
+            try:
+                alerta = json.loads(linha)
+                _gravados["chaves"].add((alerta["regra"], alerta["data"]))
+            except (ValueError, KeyError, TypeError):
+                continue
+        _gravados["posicao"] += completas
+    return _gravados["chaves"]
+
+
+def versao_dados(df: pd.DataFrame) -> tuple:
+    """Chave dos caches derivados dos deals da sessão: hash da resposta e tamanho."""
+    return st.session_state.get("deals_hash"), len(df)
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def cubo_diario(versao, _df: pd.DataFrame) -> tuple:
+    """
+    Cubo diário e indicadores em lote em cache por versão dos dados,
+    compartilhados entre as sessões (alertas e screener).
+    Retorna (cubo, lote).
+    """
+    cubo = build_daily_cube(_df)
+    return cubo, calcular_indicadores_lote(cubo)
+
+
+def calcular_cubo_indicadores(cubo: dict, lote: dict) -> np.ndarray:
+    """
+    Empilha close, SMA8, SMA20 e Bandas de Bollinger 8 de todos os produtos
+    (lote de calcular_indicadores_lote). Retorna array (séries × produtos × dias)
+    alinhado ao cubo diário.
+    """
+    return np.stack([cubo["close"]] + [lote[s] for s in SERIES[1:]])
+
+
+def _colunas_comuns(datas: np.ndarray, linha_a: int, linha_b: int) -> tuple | None:
+    """
+    Colunas, em A e em B, dos dois últimos dias negociados pelos dois produtos.
+    O cubo é alinhado à direita por produto, então a mesma coluna pode ser
+    dias diferentes em A e B. Retorna None com menos de dois dias em comum.
+    """
+    dias_a, dias_b = datas[linha_a], datas[linha_b]
+    validos_a = np.flatnonzero(~np.isnat(dias_a))
+    validos_b = np.flatnonzero(~np.isnat(dias_b))
+    _, ia, ib = np.intersect1d(
+        dias_a[validos_a], dias_b[validos_b], assume_unique=True, return_indices=True
+    )
+    if len(ia) < 2:
+        return None
+    return validos_a[ia[-2:]], validos_b[ib[-2:]]
+
+
+def compilar_regras(regras: list, produtos: np.ndarray, datas: np.ndarray) -> dict:
+    """
+    Converte a lista de regras em arrays paralelos para avaliação vetorizada.
+    col_a/col_b são as colunas do cubo comparadas (penúltimo e último dia):
+    os dois últimos pregões do produto ou, em spreads, os dois últimos dias
+    em comum de A e B. Regras com produtos ausentes do cubo (ou spreads sem
+    dois dias em comum) recebem linha -1 e nunca disparam.
+    """
+    linha_por_produto = {p: i for i, p in enumerate(produtos.tolist())}
+    n = len(regras)
+    n_dias = datas.shape[-1]
+    ultimas = np.array([max(n_dias - 2, 0), max(n_dias - 1, 0)], dtype=np.intp)
+    compiladas = {
+        "serie_esq": np.zeros(n, dtype=np.intp),
+        "serie_dir": np.zeros(n, dtype=np.intp),
+        "fixo": np.zeros(n, dtype=bool),
+        "sobe": np.zeros(n, dtype=bool),
+        "linha_a": np.full(n, -1, dtype=np.intp),
+        "linha_b": np.full(n, -1, dtype=np.intp),
+        "col_a": np.tile(ultimas, (n, 1)),
+        "col_b": np.tile(ultimas, (n, 1)),
+        "valor": np.zeros(n),
+    }
+    comuns = {}  # (linha_a, linha_b) -> colunas, calculadas uma vez por par
+    for i, regra in enumerate(regras):
+        serie_esq, serie_dir, sobe, usa_b = TIPOS_REGRA[regra["tipo"]]
+        compiladas["serie_esq"][i] = serie_esq
+        compiladas["serie_dir"][i] = serie_dir if serie_dir is not None else 0
+        compiladas["fixo"][i] = serie_dir is None
+        compiladas["sobe"][i] = sobe
+        compiladas["valor"][i] = float(regra.get("valor") or 0.0)
+        linha_a = linha_por_produto.get(regra.get("produto"), -1)
+        if not usa_b:
+            compiladas["linha_a"][i] = linha_a
+            continue
+
+        # Spread sem produto B encontrado (ou sem dias em comum) não pode ser avaliado
+        linha_b = linha_por_produto.get(regra.get("produto_b"), -1)
+        if linha_a < 0 or linha_b < 0:
+            continue
+        if (linha_a, linha_b) not in comuns:
+            comuns[(linha_a, linha_b)] = _colunas_comuns(datas, linha_a, linha_b)
+        colunas = comuns[(linha_a, linha_b)]
+        if colunas is None:
+            continue
+        compiladas["linha_a"][i], compiladas["linha_b"][i] = linha_a, linha_b
+        compiladas["col_a"][i], compiladas["col_b"][i] = colunas
+    return compiladas
+
+
+def avaliar_regras(indicadores: np.ndarray, compiladas: dict) -> np.ndarray:
+    """
+    Avalia todas as regras de uma vez sobre as colunas col_a/col_b de cada regra.
+    Uma regra dispara quando o lado esquerdo cruza o direito entre o penúltimo e
+    o último dia. Retorna máscara booleana com uma posição por regra.
+    """
+    n = len(compiladas["valor"])
+    if n == 0 or indicadores.shape[-1] < 2:
+        return np.zeros(n, dtype=bool)
+
+    validas = compiladas["linha_a"] >= 0
+    linha_a = np.where(validas, compiladas["linha_a"], 0)[:, None]
+    usa_b = compiladas["linha_b"] >= 0
+    linha_b = np.where(usa_b, compiladas["linha_b"], 0)[:, None]
+    col_a, col_b = compiladas["col_a"], compiladas["col_b"]
+
+    # regras × (penúltimo, último)
+    esquerda = indicadores[compiladas["serie_esq"][:, None], linha_a, col_a]
+    esquerda = esquerda - np.where(
+        usa_b[:, None], indicadores[_CLOSE, linha_b, col_b], 0.0
+    )
+    direita = np.where(
+        compiladas["fixo"][:, None],
+        compiladas["valor"][:, None],
+        indicadores[compiladas["serie_dir"][:, None], linha_a, col_a],
+    )
+
+    antes, depois = esquerda[:, 0] - direita[:, 0], esquerda[:, 1] - direita[:, 1]
+    with np.errstate(invalid="ignore"):
+        cruzou = np.where(
+            compiladas["sobe"], (antes <= 0) & (depois > 0), (antes >= 0) & (depois < 0)
+        )
+    return cruzou & validas
+
+
+def processar_alertas(df: pd.DataFrame) -> list:
+    """
+    Avalia as regras de alerta após uma atualização de deals.
+    Grava os alertas disparados no arquivo ALERTS_FILE (um JSON por linha),
+    uma vez por (regra, dia) entre todas as sessões, e registra os tempos de
+    execução em st.session_state.alertas_tempos.
+    """
+    regras = carregar_regras()
+    if not regras:
+        return []
+
+    inicio = time.perf_counter()
+    cubo, lote = cubo_diario(versao_dados(df), df)
+    indicadores = calcular_cubo_indicadores(cubo, lote)
+    meio = time.perf_counter()
+    compiladas = compilar_regras(regras, cubo["produtos"], cubo["datas"])
+    disparos = avaliar_regras(indicadores, compiladas)
+    fim = time.perf_counter()
+
+    tempos = {
+        "cubo_ms": (meio - inicio) * 1000,
+        "avaliacao_ms": (fim - meio) * 1000,
+        "regras": len(regras),
+    }
+    st.session_state.alertas_tempos = tempos
+
+    candidatos = []
+    for i in np.flatnonzero(disparos).tolist():
+        regra = regras[i]
+        linha = compiladas["linha_a"][i]
+        # Último dia avaliado pela regra (em spreads, o último dia em comum)
+        coluna = compiladas["col_a"][i, 1]
+        candidatos.append(
+            {
+                "regra": regra["id"],
+                "tipo": regra["tipo"],
+                "produto": regra["produto"],
+                "produto_b": regra.get("produto_b"),
+                "valor": regra.get("valor"),
+                "data": pd.Timestamp(cubo["datas"][linha, coluna]).strftime("%Y-%m-%d"),
+                "close": float(cubo["close"][linha, coluna]),
+                "disparado_em": datetime.now().isoformat(timespec="seconds"),
+            }
+        )
+
+    # Evita repetir o mesmo cruzamento a cada atualização e entre sessões:
+    # a deduplicação consulta o próprio arquivo, sob um lock do processo
+    with _gravados_lock:
+        ja_gravados = _chaves_gravadas()
+        novos = [a for a in candidatos if (a["regra"], a["data"]) not in ja_gravados]
+        if novos:
+            with open(_arquivo_alertas(), "a", encoding="utf-8") as f:
+                for alerta in novos:
+                    f.write(json.dumps(alerta, ensure_ascii=False) + "\n")
+    return novos
+
+
+def ler_alertas(limite: int = 50) -> list:
+    """Retorna os últimos alertas gravados, do mais recente ao mais antigo."""
+    try:
+        with open(_arquivo_alertas(), encoding="utf-8") as f:
+            linhas = f.readlines()[-limite:]
+    except OSError:
+        return []
+    alertas = []
+    for linha in reversed(linhas):
+        try:
+            alertas.append(json.loads(linha))
+        except ValueError:
+            continue
+    return alertas
@@ -3,9 +3,24 @@ import json
 import requests
 import pandas as pd
 import streamlit as st
-from datetime import datetime
+from datetime import datetime, timedelta
 
-AMBIENTE = "https://api-ehub.bbce.com.br/"
+from src.alerts import processar_alertas
+from src.data_processing import filtrar_deals, merge_deals
+from src.http_cache import cached_get
+from src.retention import (
+    aplicar_retencao,
+    barras_vazias,
+    carregar_agregados,
+    configuracao,
+    salvar_agregados,
+)
+
+# Pode ser apontado para um servidor local (ex.: bench/bbce_stub.py)
+AMBIENTE = os.getenv("BBCE_API_URL") or "https://api-ehub.bbce.com.br/"
+
+# Dias recarregados a cada atualização periódica (cobre cancelamentos recentes)
+JANELA_REFRESH_DIAS = 3
 
 
 def _get_secret(key: str) -> str:
@@ -45,7 +60,7 @@ def get_wallet(token: str, api_key: str) -> str | None:
     """Retorna o ID da primeira wallet encontrada."""
     url = AMBIENTE + "bus/v1/wallets"
     try:
-        response = requests.get(
+        response = cached_get(
             url,
             headers={
                 "Accept": "application/json",
@@ -55,10 +70,10 @@ def get_wallet(token: str, api_key: str) -> str | None:
             timeout=30,
         )
         if response.status_code == 200:
-            wallets = response.json()
+            wallets = json.loads(response.content)
             if wallets:
                 return wallets[0]["id"]
-    except requests.RequestException:
+    except (requests.RequestException, ValueError):
         pass
     return None
 
@@ -67,7 +82,7 @@ def get_negotiable_tickers(token: str, api_key: str, wallet_id: str) -> list:
     """Retorna lista de tickers negociáveis para a wallet."""
     url = AMBIENTE + f"bus/v1/negotiable-tickers?walletId={wallet_id}"
     try:
-        response = requests.get(
+        response = cached_get(
             url,
             headers={
                 "Accept": "application/json",
@@ -77,8 +92,8 @@ def get_negotiable_tickers(token: str, api_key: str, wallet_id: str) -> list:
             timeout=30,
         )
         if response.status_code == 200:
-            return response.json().get("tickers", [])
-    except requests.RequestException:
+            return json.loads(response.content).get("tickers", [])
+    except (requests.RequestException, ValueError):
         pass
     return []
 
@@ -87,12 +102,23 @@ def load_deals(
     token: str, api_key: str, data_inicio: str, data_fim: str
 ) -> pd.DataFrame:
     """Carrega negócios do período e retorna DataFrame indexado por createdAt."""
+    df, _ = load_deals_if_changed(token, api_key, data_inicio, data_fim)
+    return df if df is not None else pd.DataFrame()
+
+
+def load_deals_if_changed(
+    token: str, api_key: str, data_inicio: str, data_fim: str, hash_anterior: str = None
+) -> tuple:
+    """
+    Como load_deals, mas retorna (df, hash do corpo da resposta).
+    Se o corpo for idêntico a hash_anterior, não faz o parse e retorna (None, hash).
+    """
     url = (
         AMBIENTE
         + f"bus/v1/all-deals/report?initialPeriod={data_inicio}&finalPeriod={data_fim}"
     )
     try:
-        response = requests.get(
+        response = cached_get(
             url,
             headers={
                 "Accept": "application/json",
@@ -102,58 +128,67 @@ def load_deals(
             timeout=60,
         )
         if response.status_code == 200:
-            data = response.json()
-            if isinstance(data, list) and data:
-                df = pd.DataFrame(data)
-                df["createdAt"] = pd.to_datetime(df["createdAt"])
-                df.set_index("createdAt", inplace=True)
-                return df
-    except requests.RequestException as e:
+            if hash_anterior is not None and response.hash == hash_anterior:
+                return None, response.hash
+            data = json.loads(response.content)
+            if isinstance(data, list):
+                return parse_deals(data), response.hash
+    except (requests.RequestException, ValueError) as e:
         st.error(f"Erro ao carregar dados: {e}")
-    return pd.DataFrame()
+    return pd.DataFrame(), None
 
 
-def connect_bbce() -> bool:
-    """
-    Realiza login, busca wallet e tickers, carrega deals e popula st.session_state.
-    Retorna True em caso de sucesso.
-    """
-    api_key = _get_secret("BBCE_API_KEY")
-    company_code = int(_get_secret("BBCE_COMPANY_CODE"))
-    email = _get_secret("BBCE_EMAIL")
-    password = _get_secret("BBCE_PASSWORD")
-
-    login_result = login_api(company_code, email, password, api_key)
-    if not login_result:
-        st.error("Falha no login com a BBCE.")
-        return False
-
-    token = login_result[1]
-    refresh_token = login_result[3]
+def parse_deals(data: list) -> pd.DataFrame:
+    """Converte a lista de negócios da API em DataFrame indexado por createdAt."""
+    if not data:
+        return pd.DataFrame()
+    df = pd.DataFrame(data)
+    df["createdAt"] = pd.to_datetime(df["createdAt"])
+    df.set_index("createdAt", inplace=True)
+    return df
 
-    wallet_id = get_wallet(token, api_key)
-    if not wallet_id:
-        st.error("Não foi possível encontrar a wallet.")
-        return False
 
+def _carregar_dados(token: str, api_key: str, wallet_id: str) -> dict | None:
+    """
+    Busca tickers e deals e monta as estruturas grandes da sessão
+    (df, barras agregadas, produtos ordenados). Retorna None se não houver dados.
+    """
     tickers_raw = get_negotiable_tickers(token, api_key, wallet_id)
     tickers_validos = [
         t for t in tickers_raw if _is_valid_product_name(t.get("description", ""))
     ]
 
-    data_inicio = "2025-01-01"
+    # Períodos já consolidados em disco não são buscados de novo
+    store = carregar_agregados()
+    if store is not None:
+        data_inicio = pd.Timestamp(store["ate"]).strftime("%Y-%m-%d")
+    else:
+        data_inicio = configuracao()["inicio"]
     data_fim = datetime.now().strftime("%Y-%m-%d")
-    df = load_deals(token, api_key, data_inicio, data_fim)
+    df, deals_hash = load_deals_if_changed(token, api_key, data_inicio, data_fim)
 
     if df.empty:
         st.error("Nenhum dado retornado da BBCE.")
-        return False
+        return None
 
-    df = df[(df["originOperationType"] == "Match") & (df["status"] == "Ativo")]
+    df = filtrar_deals(df)
+    df, agregados, agregados_ate = _reter(
+        df,
+        store["barras"] if store is not None else None,
+        store["ate"] if store is not None else None,
+    )
 
-    # Produtos ordenados por volume total
-    volume_por_produto = df.groupby("productId")["quantity"].sum().sort_values(
-        ascending=False
+    # Produtos ordenados por volume total (deals brutos + barras agregadas)
+    volume_por_produto = (
+        pd.concat(
+            [
+                df.groupby("productId")["quantity"].sum(),
+                agregados.groupby("productId")["volume"].sum(),
+            ]
+        )
+        .groupby(level=0)
+        .sum()
+        .sort_values(ascending=False)
     )
     produtos = []
     for product_id in volume_por_produto.index:
@@ -174,40 +209,151 @@ def connect_bbce() -> bool:
                 }
             )
 
+    return {
+        "tickers": tickers_validos,
+        "df": df,
+        "deals_hash": deals_hash,
+        "agregados": agregados,
+        "agregados_ate": agregados_ate,
+        "produtos_ordenados": produtos,
+    }
+
+
+def connect_bbce() -> bool:
+    """
+    Realiza login, busca wallet e tickers, carrega deals e popula st.session_state.
+    Retorna True em caso de sucesso.
+    """
+    api_key = _get_secret("BBCE_API_KEY")
+    company_code = int(_get_secret("BBCE_COMPANY_CODE"))
+    email = _get_secret("BBCE_EMAIL")
+    password = _get_secret("BBCE_PASSWORD")
+
+    login_result = login_api(company_code, email, password, api_key)
+    if not login_result:
+        st.error("Falha no login com a BBCE.")
+        return False
+
+    token = login_result[1]
+    refresh_token = login_result[3]
+
+    wallet_id = get_wallet(token, api_key)
+    if not wallet_id:
+        st.error("Não foi possível encontrar a wallet.")
+        return False
+
+    dados = _carregar_dados(token, api_key, wallet_id)
+    if dados is None:
+        return False
+
     st.session_state.token = token
     st.session_state.refresh_token = refresh_token
     st.session_state.api_key = api_key
     st.session_state.wallet_id = wallet_id
-    st.session_state.tickers = tickers_validos
-    st.session_state.df = df
-    st.session_state.produtos_ordenados = produtos
+    for chave, valor in dados.items():
+        st.session_state[chave] = valor
     st.session_state.ultima_atualizacao = datetime.now()
     st.session_state.logado_bbce = True
     st.session_state.range_type = "2M"
 
+    processar_alertas(dados["df"])
+    return True
+
+
+def restaurar_dados() -> bool:
+    """
+    Reconstrói os dados de uma sessão cuja memória foi liberada (src/memory.py)
+    sem novo login: tickers e deals vêm do cache HTTP compartilhado e o
+    histórico antigo das barras agregadas em disco. Retorna True se ok.
+    """
+    if not st.session_state.get("token"):
+        return False
+    dados = _carregar_dados(
+        st.session_state.token, st.session_state.api_key, st.session_state.wallet_id
+    )
+    if dados is None:
+        return False
+
+    for chave, valor in dados.items():
+        st.session_state[chave] = valor
+    del st.session_state["memoria_liberada"]
+    st.session_state.ultima_atualizacao = datetime.now()
+    processar_alertas(dados["df"])
     return True
 
 
 def refresh_deals() -> bool:
-    """Recarrega apenas os deals (para atualização periódica). Retorna True se ok."""
+    """
+    Recarrega os deals (para atualização periódica). Retorna True se ok.
+    Com deals já carregados, busca só os últimos JANELA_REFRESH_DIAS dias e
+    substitui esse trecho no df atual. Uma janela vazia não substitui nada:
+    ela contém o último negócio carregado, então resposta vazia indica falha
+    da API e não ausência de negócios.
+
+    Cancelamentos e negócios lançados com data anterior à janela não chegam à
+    sessão até o próximo login (a carga completa antiga os pegava a cada
+    atualização). bench/replay.py conta esses eventos.
+    """
     if "token" not in st.session_state or not st.session_state.token:
         return False
+    # Sessão liberada por ociosidade: os dados só voltam quando o usuário voltar
+    if st.session_state.get("memoria_liberada"):
+        return False
 
-    data_inicio = "2025-01-01"
+    df_atual = st.session_state.get("df")
+    incremental = df_atual is not None and not df_atual.empty
+    if incremental:
+        desde = df_atual.index.max().normalize() - timedelta(days=JANELA_REFRESH_DIAS)
+        data_inicio = desde.strftime("%Y-%m-%d")
+    else:
+        data_inicio = pd.Timestamp(
+            st.session_state.get("agregados_ate") or configuracao()["inicio"]
+        ).strftime("%Y-%m-%d")
     data_fim = datetime.now().strftime("%Y-%m-%d")
-    df = load_deals(
-        st.session_state.token, st.session_state.api_key, data_inicio, data_fim
+    df, deals_hash = load_deals_if_changed(
+        st.session_state.token,
+        st.session_state.api_key,
+        data_inicio,
+        data_fim,
+        st.session_state.get("deals_hash"),
     )
 
-    if df.empty:
+    # Resposta idêntica à anterior: mantém o df atual e evita recalcular tudo
+    if df is None:
+        st.session_state.ultima_atualizacao = datetime.now()
+        return True
+    if deals_hash is None or df.empty:
+        # Hash não é guardado: a próxima atualização busca a janela de novo
         return False
 
-    df = df[(df["originOperationType"] == "Match") & (df["status"] == "Ativo")]
+    df = filtrar_deals(df)
+    if incremental:
+        df = merge_deals(df_atual, df, desde)
+    df, st.session_state.agregados, st.session_state.agregados_ate = _reter(
+        df, st.session_state.get("agregados"), st.session_state.get("agregados_ate")
+    )
     st.session_state.df = df
+    st.session_state.deals_hash = deals_hash
     st.session_state.ultima_atualizacao = datetime.now()
+    processar_alertas(df)
     return True
 
 
+def _reter(df: pd.DataFrame, agregados, ate) -> tuple:
+    """
+    Aplica a retenção em camadas: deals anteriores ao corte viram barras
+    agregadas, gravadas em disco quando o corte avança.
+    Retorna (deals recentes, barras agregadas, data até onde as barras cobrem).
+    """
+    if agregados is None:
+        agregados = barras_vazias(df.index.tz)
+    df, agregados, corte = aplicar_retencao(df, agregados)
+    if ate is None or corte > pd.Timestamp(ate):
+        salvar_agregados(agregados, corte)
+        ate = corte
+    return df, agregados, ate
+
+
 def _is_valid_product_name(description: str) -> bool:
     """Retorna False para nomes no padrão 'Produto 1234' ou sem letras."""
     import re
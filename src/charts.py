@@ -1,9 +1,17 @@
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+from src.data_processing import downsample_minmax, downsample_ohlc
+
 COLORS_IND = {"SMA8": "#FB8E00", "SMA20": "#1E88E5", "SMA50": "#4CAF50"}
 
+# Pixels por faixa ao reduzir o detalhe: um candle agregado e, nas linhas, o
+# par mín/máx da faixa (um ponto por coluna de pixel)
+PX_POR_FAIXA = 2
+COLUNAS_LINHAS = ["SMA8", "SMA20", "SMA50", "BB_upper", "BB_mid", "BB_lower"]
+
 
 def _last_valid(series: pd.Series):
     """Retorna o último valor não-nulo de uma Series, ou None."""
@@ -11,21 +19,73 @@ def _last_valid(series: pd.Series):
     return clean.iloc[-1] if not clean.empty else None
 
 
+def _formatar_datas(index: pd.DatetimeIndex) -> list:
+    """Rótulos do eixo categórico; inclui o ano quando o período passa de um ano."""
+    formato = "%d/%m/%y" if (index[-1] - index[0]).days > 365 else "%d/%m"
+    return index.strftime(formato).tolist()
+
+
+def _compactar(df: pd.DataFrame) -> pd.DataFrame:
+    """Arredonda preços a centavos e volume a inteiro para encurtar o JSON da figura."""
+    df = df.round(2)
+    if "volume" in df.columns:
+        df["volume"] = df["volume"].fillna(0).astype(np.int64)
+    return df
+
+
+def _centrar_pares(linhas: pd.DataFrame) -> pd.DataFrame:
+    """
+    Põe o par mín/máx de cada faixa (de downsample_minmax) no centro das suas
+    duas colunas de pixel, faixa ± 1/4, numa grade de 1/4 de categoria. As
+    posições vagas ficam NaN e a linha passa por cima (connectgaps). A grade
+    começa na categoria 0, então o 1º ponto da 1ª faixa fica no centro dela.
+    """
+    faixas = len(linhas) // 2
+    posicoes = 4 * np.repeat(np.arange(faixas), 2) + np.tile([-1, 1], faixas)
+    posicoes[0] = 0
+    grade = np.full((4 * faixas - 2, linhas.shape[1]), np.nan)
+    grade[posicoes] = linhas.to_numpy()
+    return pd.DataFrame(grade, columns=linhas.columns)
+
+
 def plot_produto_com_volume(
     df_filtrado: pd.DataFrame,
     indicadores: list,
     height: int = 550,
+    perfil: dict | None = None,
+    largura_px: int | None = None,
 ) -> go.Figure:
     """
     Gráfico candlestick + volume em barras.
     Usa eixo categórico (apenas dias com negociação).
+    Se perfil (de calcular_volume_profile) for informado, sobrepõe o volume por
+    preço em barras horizontais no eixo de preço, com POC e value area.
+    Com largura_px, agrega candles que não caberiam na largura do gráfico e
+    reduz os indicadores às mesmas faixas preservando mínimos e máximos.
     """
     if df_filtrado.empty:
         fig = go.Figure()
         fig.add_annotation(text="Sem dados disponíveis", x=0.5, y=0.5, showarrow=False)
         return fig
 
-    datas_str = df_filtrado.index.strftime("%d/%m").tolist()
+    linhas = df_filtrado[[c for c in COLUNAS_LINHAS if c in df_filtrado.columns]]
+    # Rótulos da legenda pelo último valor real, antes de reduzir
+    ultimos = {col: _last_valid(linhas[col]) for col in linhas.columns}
+    n_dias = len(df_filtrado)
+    # Só reduz quando sobram mais de dois dias por faixa
+    if largura_px and n_dias > 2 * (largura_px // PX_POR_FAIXA):
+        df_filtrado = downsample_ohlc(df_filtrado, largura_px // PX_POR_FAIXA)
+        linhas = downsample_minmax(linhas, largura_px // PX_POR_FAIXA)
+    df_filtrado = _compactar(df_filtrado)
+    # Um décimo de R$/MWh fica abaixo de um pixel no painel de preço
+    linhas = linhas.round(1)
+    datas_str = _formatar_datas(df_filtrado.index)
+    # Linhas sem datas próprias: começam na primeira categoria dos candles e
+    # andam dx categorias por ponto
+    eixo_linhas = dict(x0=datas_str[0], dx=1, connectgaps=True)
+    if len(df_filtrado) < n_dias:
+        linhas = _centrar_pares(linhas)
+        eixo_linhas["dx"] = 0.25
 
     fig = make_subplots(
         rows=2,
@@ -55,13 +115,13 @@ def plot_produto_com_volume(
 
     # Indicadores
     for ind in indicadores:
-        if ind in ("SMA8", "SMA20", "SMA50") and ind in df_filtrado.columns:
-            ultimo = _last_valid(df_filtrado[ind])
+        if ind in ("SMA8", "SMA20", "SMA50") and ind in linhas.columns:
+            ultimo = ultimos[ind]
             label = f"<b>{ind}</b>: {ultimo:.1f}" if ultimo is not None else ind
             fig.add_trace(
                 go.Scatter(
-                    x=datas_str,
-                    y=df_filtrado[ind],
+                    **eixo_linhas,
+                    y=linhas[ind],
                     mode="lines",
                     name=label,
                     line=dict(color=COLORS_IND.get(ind, "gray"), width=1.5),
@@ -70,13 +130,13 @@ def plot_produto_com_volume(
                 col=1,
             )
 
-        elif ind == "Bollinger Bands 8" and "BB_upper" in df_filtrado.columns:
-            ultimo_mid = _last_valid(df_filtrado["BB_mid"])
+        elif ind == "Bollinger Bands 8" and "BB_upper" in linhas.columns:
+            ultimo_mid = ultimos["BB_mid"]
 
             fig.add_trace(
                 go.Scatter(
-                    x=datas_str,
-                    y=df_filtrado["BB_upper"],
+                    **eixo_linhas,
+                    y=linhas["BB_upper"],
                     mode="lines",
                     name="BB Sup",
                     line=dict(color="rgba(255,99,71,0.5)", width=1, dash="dash"),
@@ -86,8 +146,8 @@ def plot_produto_com_volume(
             )
             fig.add_trace(
                 go.Scatter(
-                    x=datas_str,
-                    y=df_filtrado["BB_mid"],
+                    **eixo_linhas,
+                    y=linhas["BB_mid"],
                     mode="lines",
                     name=f"<b>BB Mid</b>: {ultimo_mid:.1f}"
                     if ultimo_mid is not None
@@ -101,8 +161,8 @@ def plot_produto_com_volume(
             )
             fig.add_trace(
                 go.Scatter(
-                    x=datas_str,
-                    y=df_filtrado["BB_lower"],
+                    **eixo_linhas,
+                    y=linhas["BB_lower"],
                     mode="lines",
                     name="BB Inf",
                     line=dict(color="rgba(255,99,71,0.5)", width=1, dash="dash"),
@@ -115,18 +175,22 @@ def plot_produto_com_volume(
 
     # Volume
     if "volume" in df_filtrado.columns:
-        colors_vol = [
-            "#ef5350"
-            if df_filtrado["close"].iloc[i] < df_filtrado["open"].iloc[i]
-            else "#26a69a"
-            for i in range(len(df_filtrado))
-        ]
+        # 0/1 com escala de cores em vez de uma string de cor por barra
+        queda = (df_filtrado["close"] < df_filtrado["open"]).to_numpy(dtype=np.int8)
         fig.add_trace(
             go.Bar(
-                x=datas_str,
+                # Eixo ligado ao dos candles (matches): mesmas categorias, sem
+                # repetir as datas
+                x0=datas_str[0],
+                dx=1,
                 y=df_filtrado["volume"],
                 name="Volume",
-                marker_color=colors_vol,
+                marker=dict(
+                    color=queda,
+                    colorscale=[[0, "#26a69a"], [1, "#ef5350"]],
+                    cmin=0,
+                    cmax=1,
+                ),
                 hovertemplate="<b>%{y:,.0f} MWm</b><extra></extra>",
                 showlegend=False,
             ),
@@ -160,19 +224,76 @@ def plot_produto_com_volume(
         title_font=dict(size=14)
     )
 
+    # Depois de update_xaxes, que tornaria categórico também o eixo do perfil
+    if perfil:
+        _add_volume_profile(fig, perfil, df_filtrado.index[0])
+
     return fig
 
 
+def _add_volume_profile(fig: go.Figure, perfil: dict, inicio_grafico: pd.Timestamp) -> None:
+    """
+    Barras horizontais de volume por preço ancoradas à direita do painel de preço.
+    O perfil só cobre os deals brutos: se o gráfico começa antes, o rótulo do
+    POC informa desde quando ele vale.
+    """
+    volumes = perfil["volumes"]
+    rotulo = f"POC {perfil['poc']:.1f}"
+    if perfil["inicio"].normalize() > inicio_grafico.normalize():
+        rotulo += f" • perfil desde {perfil['inicio']:%d/%m/%y}"
+    fig.add_trace(
+        go.Bar(
+            x=volumes,
+            y=perfil["precos"],
+            orientation="h",
+            xaxis="x3",
+            yaxis="y",
+            width=perfil["tamanho_bin"] * 0.9,
+            marker_color=[
+                "rgba(30,136,229,0.35)"
+                if perfil["va_low"] <= p <= perfil["va_high"]
+                else "rgba(120,120,120,0.2)"
+                for p in perfil["precos"]
+            ],
+            name="Volume Profile",
+            hovertemplate="R$ %{y:.1f}: <b>%{x:,.0f} MWm</b><extra></extra>",
+            showlegend=False,
+        )
+    )
+    # Eixo próprio invertido: barras crescem da borda direita e ocupam ~25% da largura
+    fig.update_layout(
+        xaxis3=dict(
+            overlaying="x",
+            anchor="y",
+            side="top",
+            type="linear",
+            range=[float(volumes.max()) * 4, 0],
+            visible=False,
+        )
+    )
+    fig.add_hline(
+        y=perfil["poc"], line_color="#1E88E5", line_width=1, line_dash="dot",
+        annotation_text=rotulo, annotation_position="top left",
+        row=1, col=1,
+    )
+    fig.add_hrect(
+        y0=perfil["va_low"], y1=perfil["va_high"], fillcolor="rgba(30,136,229,0.05)",
+        line_width=0, row=1, col=1,
+    )
+
+
 def plot_spread_area(
     df_produto1: pd.DataFrame,
     df_produto2: pd.DataFrame,
     nome1: str,
     nome2: str,
     height: int = 550,
+    largura_px: int | None = None,
 ) -> go.Figure:
     """
     Gráfico de spread (produto1.close - produto2.close) como área preenchida.
-    Usa eixo categórico.
+    Usa eixo categórico. Com largura_px, reduz a linha a mín/máx
+    por faixa de PX_POR_FAIXA pixels.
     """
     if df_produto1.empty or df_produto2.empty:
         fig = go.Figure()
@@ -195,14 +316,19 @@ def plot_spread_area(
             - df_produto2.loc[datas_comuns, "close"]
         )
 
-    ultimo_spread = df_spread["spread"].iloc[-1]
-    datas_str = df_spread.index.strftime("%d/%m").tolist()
+    spread = df_spread["spread"]
+    ultimo_spread = round(spread.iloc[-1], 2)
+    # Só reduz quando sobram mais de dois dias por faixa
+    if largura_px and len(spread) > 2 * (largura_px // PX_POR_FAIXA):
+        spread = downsample_minmax(spread, largura_px // PX_POR_FAIXA)
+    spread = spread.round(2)
+    datas_str = _formatar_datas(spread.index)
 
     fig = go.Figure()
     fig.add_trace(
         go.Scatter(
             x=datas_str,
-            y=df_spread["spread"],
+            y=spread,
             mode="lines",
             fill="tozeroy",
             name="Spread",
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 
@@ -22,11 +23,48 @@ def get_filtered_data_by_range(df: pd.DataFrame, range_type: str) -> pd.DataFram
     return df[df.index >= ranges[range_type]]
 
 
+def filtrar_deals(df: pd.DataFrame) -> pd.DataFrame:
+    """Mantém apenas negócios fechados (Match) e ativos."""
+    if df.empty:
+        return df
+    return df[(df["originOperationType"] == "Match") & (df["status"] == "Ativo")]
+
+
+def merge_deals(
+    df_atual: pd.DataFrame, df_janela: pd.DataFrame, desde: pd.Timestamp
+) -> pd.DataFrame:
+    """
+    Atualiza os deals com uma janela recarregada a partir de desde: descarta os
+    negócios atuais a partir dessa data e anexa os da janela. O resultado é
+    igual a recarregar o histórico inteiro, desde que a janela cubra qualquer
+    alteração (novos negócios, cancelamentos) ocorrida desde então.
+    """
+    antigos = df_atual[df_atual.index < desde]
+    if df_janela.empty:
+        return antigos
+    if antigos.empty:
+        return df_janela
+    return pd.concat([antigos, df_janela])
+
+
+def _por_camada(df: pd.DataFrame, funcao) -> pd.Series:
+    """
+    Aplica funcao ao close de cada granularidade (coluna de build_ohlc com
+    barras antigas) em separado: uma janela não mistura meses, semanas e dias.
+    """
+    if "granularidade" not in df.columns:
+        return funcao(df["close"])
+    # A barra intraday acrescentada depois não tem granularidade: é diária
+    camadas = df["granularidade"].fillna("D")
+    return df["close"].groupby(camadas, sort=False).transform(funcao)
+
+
 def calcular_indicadores(
     df: pd.DataFrame, indicadores: list
 ) -> pd.DataFrame:
     """
-    Calcula indicadores técnicos no DataFrame OHLC completo.
+    Calcula indicadores técnicos no DataFrame OHLC completo, em separado por
+    granularidade quando há barras agregadas (SMA8 mensal = 8 meses).
     Deve ser chamado antes de aplicar filtro de período.
     """
     if df.empty:
@@ -35,14 +73,14 @@ def calcular_indicadores(
     df = df.copy()
 
     if "SMA8" in indicadores:
-        df["SMA8"] = df["close"].rolling(window=8, min_periods=1).mean()
+        df["SMA8"] = _por_camada(df, lambda c: c.rolling(window=8, min_periods=1).mean())
     if "SMA20" in indicadores:
-        df["SMA20"] = df["close"].rolling(window=20, min_periods=1).mean()
+        df["SMA20"] = _por_camada(df, lambda c: c.rolling(window=20, min_periods=1).mean())
     if "SMA50" in indicadores:
-        df["SMA50"] = df["close"].rolling(window=50, min_periods=1).mean()
+        df["SMA50"] = _por_camada(df, lambda c: c.rolling(window=50, min_periods=1).mean())
     if "Bollinger Bands 8" in indicadores:
-        rolling_mean = df["close"].rolling(window=8, min_periods=1).mean()
-        rolling_std = df["close"].rolling(window=8, min_periods=1).std()
+        rolling_mean = _por_camada(df, lambda c: c.rolling(window=8, min_periods=1).mean())
+        rolling_std = _por_camada(df, lambda c: c.rolling(window=8, min_periods=1).std())
         df["BB_upper"] = rolling_mean + (rolling_std * 2)
         df["BB_mid"] = rolling_mean
         df["BB_lower"] = rolling_mean - (rolling_std * 2)
@@ -50,13 +88,21 @@ def calcular_indicadores(
     return df
 
 
-def calcular_vwap(df_product: pd.DataFrame) -> pd.Series:
+def calcular_vwap(
+    df_product: pd.DataFrame, barras_antigas: pd.DataFrame | None = None
+) -> pd.Series:
     """
     Calcula o preço médio ponderado por volume (VWAP) para cada dia.
+    Com barras_antigas (camadas agregadas de src/retention.py), inclui o VWAP
+    de cada barra antes dos dias com deals brutos.
     Retorna Series com índice DatetimeIndex (datas).
     """
+    vwap_antigo = pd.Series(dtype=float)
+    if barras_antigas is not None and not barras_antigas.empty:
+        com_volume = barras_antigas[barras_antigas["volume"] > 0]
+        vwap_antigo = com_volume["pv"] / com_volume["volume"]
     if df_product.empty:
-        return pd.Series(dtype=float)
+        return vwap_antigo
 
     df = df_product.copy()
     df["data"] = df.index.normalize()  # DatetimeIndex truncado ao dia
@@ -67,20 +113,34 @@ def calcular_vwap(df_product: pd.DataFrame) -> pd.Series:
         if total_qty > 0:
             vwap_dict[data] = (grupo["unitPrice"] * grupo["quantity"]).sum() / total_qty
 
-    return pd.Series(vwap_dict)
+    if vwap_antigo.empty:
+        return pd.Series(vwap_dict)
+    return pd.concat([vwap_antigo, pd.Series(vwap_dict, dtype=float)]).sort_index()
 
 
-def build_ohlc(df_product: pd.DataFrame) -> pd.DataFrame:
+def build_ohlc(
+    df_product: pd.DataFrame, barras_antigas: pd.DataFrame | None = None
+) -> pd.DataFrame:
     """
     Constrói DataFrame OHLC diário a partir dos trades de um produto.
-    Remove dias sem negociação.
+    Remove dias sem negociação. Com barras_antigas (camadas agregadas de
+    src/retention.py), as barras diárias/semanais/mensais mais antigas vêm
+    antes, uma linha por barra, e a coluna granularidade ("D", "W" ou "M")
+    separa as camadas para calcular_indicadores.
     """
+    antigas = None
+    if barras_antigas is not None and not barras_antigas.empty:
+        antigas = barras_antigas[["open", "high", "low", "close", "volume", "granularidade"]]
     if df_product.empty:
-        return pd.DataFrame()
+        return antigas.copy() if antigas is not None else pd.DataFrame()
 
     df_ohlc = df_product["unitPrice"].resample("D").ohlc()
     df_ohlc["volume"] = df_product.resample("D")["quantity"].sum()
-    return df_ohlc.dropna()
+    df_ohlc = df_ohlc.dropna()
+    if antigas is None:
+        return df_ohlc
+    df_ohlc["granularidade"] = "D"
+    return pd.concat([antigas, df_ohlc]).sort_index().rename_axis(df_ohlc.index.name)
 
 
 def criar_tabela_ohlc(
@@ -119,3 +179,310 @@ def criar_tabela_ohlc(
         )
 
     return pd.DataFrame(rows)
+
+
+def build_daily_cube(df: pd.DataFrame) -> dict:
+    """
+    Constrói o cubo diário de todos os produtos em uma única agregação.
+    Cada linha é um produto e as colunas são os seus dias com negociação,
+    alinhados à direita (última coluna = último pregão) e completados com NaN
+    à esquerda. Janelas móveis sobre as colunas equivalem às de
+    calcular_indicadores aplicado ao OHLC de cada produto.
+    """
+    vazio = {
+        "produtos": np.array([], dtype=object),
+        "datas": np.empty((0, 0), dtype="datetime64[ns]"),
+    }
+    for campo in ("open", "high", "low", "close", "volume"):
+        vazio[campo] = np.empty((0, 0))
+    if df.empty:
+        return vazio
+
+    # Abertura/fechamento pelo horário, como no resample de build_ohlc
+    df = df.sort_index(kind="stable")
+    dia = df.index.normalize()
+    diario = (
+        df.assign(_dia=dia)
+        .groupby(["productId", "_dia"], sort=True)
+        .agg(
+            open=("unitPrice", "first"),
+            high=("unitPrice", "max"),
+            low=("unitPrice", "min"),
+            close=("unitPrice", "last"),
+            volume=("quantity", "sum"),
+        )
+    )
+    if diario.empty:
+        return vazio
+
+    produtos, linhas = np.unique(
+        diario.index.get_level_values("productId"), return_inverse=True
+    )
+    # Posição contada a partir do fim: 0 = último pregão do produto
+    do_fim = diario.groupby(level="productId").cumcount(ascending=False).to_numpy()
+    n_dias = int(do_fim.max()) + 1
+    colunas = n_dias - 1 - do_fim
+
+    cubo = {"produtos": produtos}
+    datas = np.full((len(produtos), n_dias), np.datetime64("NaT"), dtype="datetime64[ns]")
+    datas[linhas, colunas] = diario.index.get_level_values("_dia").to_numpy()
+    cubo["datas"] = datas
+    for campo in ("open", "high", "low", "close", "volume"):
+        matriz = np.full((len(produtos), n_dias), np.nan)
+        matriz[linhas, colunas] = diario[campo].to_numpy(dtype=float)
+        cubo[campo] = matriz
+    return cubo
+
+
+def _prefixos_2d(valores: np.ndarray) -> tuple:
+    """
+    Somas cumulativas (contagem, soma, soma dos quadrados) por linha, com uma
+    coluna zero à esquerda, reutilizáveis por janelas de qualquer tamanho.
+    """
+    validos = ~np.isnan(valores)
+    x = np.where(validos, valores, 0.0)
+    # Centraliza por linha para reduzir erro numérico na soma dos quadrados
+    n = np.maximum(validos.sum(axis=1, keepdims=True), 1)
+    centro = x.sum(axis=1, keepdims=True) / n
+    x -= centro
+    x[~validos] = 0.0
+
+    linhas = valores.shape[0]
+    prefixos = np.zeros((3, linhas, valores.shape[1] + 1))
+    np.cumsum(validos, axis=1, out=prefixos[0, :, 1:])
+    np.cumsum(x, axis=1, out=prefixos[1, :, 1:])
+    np.cumsum(x * x, axis=1, out=prefixos[2, :, 1:])
+    return prefixos, centro
+
+
+def _janela_2d(prefixos: np.ndarray, janela: int) -> np.ndarray:
+    """Somas móveis de tamanho janela a partir dos prefixos (mesmo formato)."""
+    out = prefixos[:, :, 1:].copy()
+    out[:, :, janela:] -= prefixos[:, :, 1:-janela]
+    return out
+
+
+def _media_2d(somas: np.ndarray, centro: np.ndarray) -> np.ndarray:
+    contagem, soma = somas[:2]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        media = soma / contagem + centro
+    media[contagem == 0] = np.nan
+    return media
+
+
+def _desvio_2d(somas: np.ndarray) -> np.ndarray:
+    contagem, soma, quadrados = somas
+    with np.errstate(invalid="ignore", divide="ignore"):
+        var = (quadrados - soma * soma / contagem) / (contagem - 1)
+    var[contagem < 2] = np.nan
+    return np.sqrt(np.clip(var, 0.0, None))
+
+
+def rolling_mean_2d(valores: np.ndarray, janela: int) -> np.ndarray:
+    """Média móvel por linha (min_periods=1), ignorando NaN, via somas cumulativas."""
+    prefixos, centro = _prefixos_2d(valores)
+    return _media_2d(_janela_2d(prefixos[:2], janela), centro)
+
+
+def rolling_std_2d(valores: np.ndarray, janela: int) -> np.ndarray:
+    """Desvio padrão amostral móvel por linha (NaN com menos de 2 pontos)."""
+    prefixos, _ = _prefixos_2d(valores)
+    return _desvio_2d(_janela_2d(prefixos, janela))
+
+
+def calcular_indicadores_lote(cubo: dict) -> dict:
+    """
+    Calcula SMA8/20/50, Bollinger 8 e estatísticas de volume de todos os
+    produtos de uma vez sobre o cubo de build_daily_cube (produtos × dias).
+    Mesma semântica de calcular_indicadores (min_periods=1) por linha.
+    """
+    prefixos, centro = _prefixos_2d(cubo["close"])
+    somas8 = _janela_2d(prefixos, 8)
+    sma8 = _media_2d(somas8, centro)
+    desvio8 = _desvio_2d(somas8)
+
+    prefixos_vol, centro_vol = _prefixos_2d(cubo["volume"])
+    somas_vol20 = _janela_2d(prefixos_vol, 20)
+
+    return {
+        "SMA8": sma8,
+        # Médias só precisam de contagem e soma (dispensa a soma dos quadrados)
+        "SMA20": _media_2d(_janela_2d(prefixos[:2], 20), centro),
+        "SMA50": _media_2d(_janela_2d(prefixos[:2], 50), centro),
+        "BB_upper": sma8 + desvio8 * 2,
+        "BB_mid": sma8,
+        "BB_lower": sma8 - desvio8 * 2,
+        "VOL_mean20": _media_2d(somas_vol20, centro_vol),
+        "VOL_std20": _desvio_2d(somas_vol20),
+    }
+
+
+def criar_tabela_screener(cubo: dict, lote: dict, produtos: list) -> pd.DataFrame:
+    """
+    Retorna tabela com a situação atual (último pregão) de cada produto:
+    distância da SMA20, %B de Bollinger 8 e volume recente.
+    """
+    if not produtos or len(cubo["produtos"]) == 0:
+        return pd.DataFrame()
+
+    linha_por_produto = {p: i for i, p in enumerate(cubo["produtos"].tolist())}
+    presentes = [p for p in produtos if p["id"] in linha_por_produto]
+    if not presentes:
+        return pd.DataFrame()
+    linhas = np.array([linha_por_produto[p["id"]] for p in presentes])
+
+    close = cubo["close"][linhas, -1]
+    sma20 = lote["SMA20"][linhas, -1]
+    bb_upper = lote["BB_upper"][linhas, -1]
+    bb_lower = lote["BB_lower"][linhas, -1]
+    volume = cubo["volume"][linhas, -1]
+    vol_medio = lote["VOL_mean20"][linhas, -1]
+    vol_desvio = lote["VOL_std20"][linhas, -1]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dist_sma20 = (close / sma20 - 1) * 100
+        largura = bb_upper - bb_lower
+        percent_b = np.where(largura > 0, (close - bb_lower) / largura, np.nan)
+        vol_rel = volume / vol_medio
+        vol_z = np.where(vol_desvio > 0, (volume - vol_medio) / vol_desvio, np.nan)
+
+    return pd.DataFrame(
+        {
+            "Produto": [p["description"] for p in presentes],
+            "Data": pd.DatetimeIndex(cubo["datas"][linhas, -1]).strftime("%d/%m/%Y"),
+            "Close": np.round(close, 2),
+            "Dist SMA20 (%)": np.round(dist_sma20, 2),
+            "%B": np.round(percent_b, 2),
+            "Vol (MWm)": volume,
+            "Vol médio 20d": np.round(vol_medio, 0),
+            "Vol / média": np.round(vol_rel, 2),
+            "Vol z-score": np.round(vol_z, 2),
+        }
+    )
+
+
+def calcular_volume_profile(
+    df_product: pd.DataFrame, tamanho_bin: float, value_area: float = 0.7
+) -> dict:
+    """
+    Perfil de volume por preço: soma de quantity em faixas de unitPrice.
+    Retorna dict com centros das faixas, volumes, POC (faixa de maior volume),
+    limites da value area (a partir do POC, acrescenta a faixa vizinha, acima
+    ou abaixo, de maior volume até cobrir value_area do total) e o início dos
+    deals usados (inicio).
+    """
+    if df_product.empty or tamanho_bin <= 0:
+        return {}
+
+    precos = df_product["unitPrice"].to_numpy(dtype=float)
+    qtd = df_product["quantity"].to_numpy(dtype=float)
+    base = np.floor(precos.min() / tamanho_bin) * tamanho_bin
+    faixas = ((precos - base) / tamanho_bin).astype(np.intp)
+    volumes = np.bincount(faixas, weights=qtd)
+    centros = base + (np.arange(len(volumes)) + 0.5) * tamanho_bin
+
+    total = volumes.sum()
+    if total <= 0:
+        return {}
+    poc = int(np.argmax(volumes))
+    baixo = alto = poc
+    acumulado = volumes[poc]
+    while acumulado < value_area * total:
+        abaixo = volumes[baixo - 1] if baixo > 0 else -1.0
+        acima = volumes[alto + 1] if alto + 1 < len(volumes) else -1.0
+        if acima >= abaixo:
+            alto += 1
+            acumulado += acima
+        else:
+            baixo -= 1
+            acumulado += abaixo
+
+    return {
+        "precos": centros,
+        "volumes": volumes,
+        "tamanho_bin": tamanho_bin,
+        "poc": float(centros[poc]),
+        "va_low": float(centros[baixo] - tamanho_bin / 2),
+        "va_high": float(centros[alto] + tamanho_bin / 2),
+        "inicio": df_product.index.min(),
+    }
+
+
+def _inicios_buckets(n: int, max_pontos: int) -> np.ndarray:
+    """
+    Índices iniciais de até max_pontos faixas de pontos consecutivos, alinhadas
+    às colunas de um eixo com n categorias iguais: o ponto i cai na faixa
+    floor((i + 0.5) * max_pontos / n), a mesma coluna em que seria desenhado.
+    """
+    if n <= max_pontos:
+        return np.arange(n)
+    colunas = ((np.arange(n) + 0.5) * max_pontos / n).astype(np.int64)
+    return np.flatnonzero(np.diff(colunas, prepend=-1))
+
+
+def minmax_indices(y: np.ndarray, inicios: np.ndarray) -> np.ndarray:
+    """
+    Índices do mínimo e do máximo de cada faixa dada por inicios, em ordem
+    temporal (matriz faixas × 2). NaN é ignorado; faixa só com NaN repete o
+    primeiro ponto. Se mínimo e máximo coincidem (faixa constante), o par se
+    completa com outra ponta da faixa, para os dois pontos terem datas distintas.
+    """
+    fins = np.append(inicios[1:], len(y))
+    indices = np.empty((len(inicios), 2), dtype=np.intp)
+    for b, (i, f) in enumerate(zip(inicios, fins)):
+        faixa = y[i:f]
+        if np.isnan(faixa).all():
+            indices[b] = i
+            continue
+        menor, maior = i + np.nanargmin(faixa), i + np.nanargmax(faixa)
+        if menor == maior and f - i > 1:
+            maior = f - 1 if menor != f - 1 else i
+        indices[b] = np.sort([menor, maior])
+    return indices
+
+
+def downsample_ohlc(df_ohlc: pd.DataFrame, max_barras: int) -> pd.DataFrame:
+    """
+    Reduz o OHLC a no máximo max_barras agregando dias consecutivos: abertura
+    do primeiro, máxima e mínima da faixa, fechamento do último e volume somado.
+    O índice de cada faixa é a data do seu primeiro dia. Demais colunas
+    (indicadores) ficam de fora: reduza-as com downsample_minmax.
+    """
+    n = len(df_ohlc)
+    if n <= max_barras or max_barras < 3:
+        return df_ohlc
+
+    inicios = _inicios_buckets(n, max_barras)
+    fins = np.append(inicios[1:], n) - 1
+    out = pd.DataFrame(index=df_ohlc.index[inicios])
+    out["open"] = df_ohlc["open"].to_numpy()[inicios]
+    out["high"] = np.maximum.reduceat(df_ohlc["high"].to_numpy(), inicios)
+    out["low"] = np.minimum.reduceat(df_ohlc["low"].to_numpy(), inicios)
+    out["close"] = df_ohlc["close"].to_numpy()[fins]
+    if "volume" in df_ohlc.columns:
+        out["volume"] = np.add.reduceat(df_ohlc["volume"].to_numpy(), inicios)
+    return out
+
+
+def downsample_minmax(dados, max_faixas: int):
+    """
+    Reduz linhas (Series ou DataFrame de indicadores) às mesmas faixas de
+    downsample_ohlc, no estilo M4: mínimo e máximo de cada faixa, em ordem
+    temporal (dois pontos por faixa). Numa Series o índice é a data de cada
+    ponto escolhido; num DataFrame, onde cada coluna escolhe os seus, é a data
+    do primeiro dia da faixa, repetida.
+    """
+    n = len(dados)
+    if n <= max_faixas or max_faixas < 3:
+        return dados
+
+    inicios = _inicios_buckets(n, max_faixas)
+    if isinstance(dados, pd.Series):
+        escolhidos = minmax_indices(dados.to_numpy(dtype=float), inicios).ravel()
+        return dados.iloc[np.unique(escolhidos)]
+    indice = dados.index[np.repeat(inicios, 2)]
+    colunas = {}
+    for col in dados.columns:
+        valores = dados[col].to_numpy(dtype=float)
+        colunas[col] = valores[minmax_indices(valores, inicios)].ravel()
+    return pd.DataFrame(colunas, index=indice)
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import NamedTuple
+
+import requests
+from urllib3.util.request import ACCEPT_ENCODING
+
+# Codificações que o urllib3 consegue descompactar aqui (gzip, deflate e br
+# quando o pacote brotli está instalado)
+HEADERS_COMPRESSAO = {"Accept-Encoding": ACCEPT_ENCODING}
+
+
+class Resposta(NamedTuple):
+    status_code: int
+    content: bytes
+    hash: str  # sha256 do corpo, para detectar respostas idênticas
+
+
+def _cache_dir() -> Path:
+    return Path(os.getenv("HTTP_CACHE_DIR", ".http_cache"))
+
+
+def _cache_max_bytes() -> int:
+    return int(float(os.getenv("HTTP_CACHE_MAX_MB", "200")) * 1e6)
+
+
+def _chave(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+
+def _ler_meta(chave: str) -> dict | None:
+    try:
+        with open(_cache_dir() / f"{chave}.json", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _ler_corpo(chave: str) -> bytes | None:
+    try:
+        caminho = _cache_dir() / f"{chave}.body"
+        corpo = caminho.read_bytes()
+        os.utime(caminho)  # marca como usado recentemente para a evicção
+        return corpo
+    except OSError:
+        return None
+
+
+def _gravar_atomico(caminho: Path, dados: bytes) -> None:
+    """
+    Grava via arquivo temporário para não expor entradas parciais a outras sessões.
+    O temporário tem nome único (mkstemp): sessões são threads do mesmo processo.
+    """
+    fd, tmp = tempfile.mkstemp(dir=caminho.parent, prefix=caminho.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as arquivo:
+            arquivo.write(dados)
+        os.replace(tmp, caminho)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def _gravar(chave: str, meta: dict, corpo: bytes) -> None:
+    pasta = _cache_dir()
+    pasta.mkdir(parents=True, exist_ok=True)
+    _gravar_atomico(pasta / f"{chave}.body", corpo)
+    _gravar_atomico(pasta / f"{chave}.json", json.dumps(meta).encode("utf-8"))
+    _evictar()
+
+
+def _evictar() -> None:
+    """Remove as respostas usadas há mais tempo até caber no limite de tamanho."""
+    limite = _cache_max_bytes()
+    corpos = []
+    for caminho in _cache_dir().glob("*.body"):
+        try:
+            info = caminho.stat()
+        except OSError:
+            continue
+        corpos.append((info.st_mtime, info.st_size, caminho))
+
+    total = sum(tamanho for _, tamanho, _ in corpos)
+    for _, tamanho, caminho in sorted(corpos):
+        if total <= limite:
+            break
+        for arquivo in (caminho, caminho.with_suffix(".json")):
+            try:
+                arquivo.unlink()
+            except OSError:
+                pass
+        total -= tamanho
+
+
+def cached_get(url: str, headers: dict, timeout: int) -> Resposta:
+    """
+    GET com compressão, validadores condicionais e cache em disco.
+    Envia If-None-Match/If-Modified-Since quando a resposta anterior trouxe
+    ETag/Last-Modified; em 304 devolve o corpo guardado. O hash do corpo
+    permite ao chamador pular o parse quando o conteúdo não mudou.
+    Propaga requests.RequestException como requests.get.
+    """
+    chave = _chave(url)
+    meta = _ler_meta(chave)
+    headers = {**HEADERS_COMPRESSAO, **headers}
+    condicionais = dict(headers)
+    if meta:
+        if meta.get("etag"):
+            condicionais["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            condicionais["If-Modified-Since"] = meta["last_modified"]
+
+    response = requests.get(url, headers=condicionais, timeout=timeout)
+
+    if response.status_code == 304 and meta:
+        corpo = _ler_corpo(chave)
+        if corpo is not None:
+            return Resposta(200, corpo, meta["hash"])
+        # Corpo evictado entre a leitura da meta e agora: busca completo
+        meta = None
+        response = requests.get(url, headers=headers, timeout=timeout)
+
+    corpo = response.content
+    digest = hashlib.sha256(corpo).hexdigest()
+    if response.status_code != 200:
+        return Resposta(response.status_code, corpo, digest)
+
+    novo_meta = {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "hash": digest,
+    }
+    if not meta or meta.get("hash") != digest or _ler_corpo(chave) is None:
+        _gravar(chave, novo_meta, corpo)
+    elif novo_meta != meta:
+        _gravar_atomico(
+            _cache_dir() / f"{chave}.json", json.dumps(novo_meta).encode("utf-8")
+        )
+    return Resposta(200, corpo, digest)
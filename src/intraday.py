@@ -0,0 +1,222 @@
+import json
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import requests
+import streamlit as st
+
+from src.bbce_api import AMBIENTE
+from src.http_cache import cached_get
+
+NS_POR_DIA = 86_400 * 10**9
+
+
+class BarraIntraday:
+    """
+    Barra do dia corrente de um produto (OHLC, VWAP, volume). É refeita a cada
+    resposta da API, que traz o dia inteiro: negócios que chegam atrasados
+    entram e cancelados saem, sem guardar os negócios em si.
+    """
+
+    def __init__(self):
+        # Momento da resposta da API que originou a barra do dia
+        self.consultado_em = None
+        self._zerar_dia(None)
+
+    def _zerar_dia(self, dia) -> None:
+        self.dia = dia
+        self.open = self.high = self.low = self.close = np.nan
+        self.volume = 0.0
+        self.preco_x_qtd = 0.0
+        self.negocios = 0
+        self.ultimo_negocio_ts = None
+
+    def recalcular_dia(self, ts: np.ndarray, preco: np.ndarray, qtd: np.ndarray) -> bool:
+        """
+        Refaz a barra a partir de todos os negócios válidos do dia (ordenados
+        por ts); sem negócios, a barra fica vazia. Retorna True se ela mudou.
+        """
+        antes = self._estado_dia()
+        if len(ts) == 0:
+            self._zerar_dia(None)
+            return self._estado_dia() != antes
+
+        dias = ts // NS_POR_DIA
+        do_dia = dias == dias.max()
+        ts, preco, qtd = ts[do_dia], preco[do_dia], qtd[do_dia]
+        self._zerar_dia(int(dias.max()))
+        self.open, self.close = float(preco[0]), float(preco[-1])
+        self.high, self.low = float(preco.max()), float(preco.min())
+        self.volume = float(qtd.sum())
+        self.preco_x_qtd = float(preco @ qtd)
+        self.negocios = len(preco)
+        self.ultimo_negocio_ts = int(ts[-1])
+        return self._estado_dia() != antes
+
+    def _estado_dia(self) -> tuple:
+        return (
+            self.dia, self.open, self.high, self.low, self.close,
+            self.volume, self.preco_x_qtd, self.negocios, self.ultimo_negocio_ts,
+        )
+
+    def barra(self) -> dict | None:
+        """Barra do dia corrente (OHLC, VWAP, volume, negócios) ou None sem negócios."""
+        if self.dia is None or self.negocios == 0:
+            return None
+        return {
+            "data": pd.Timestamp(self.dia * NS_POR_DIA),
+            "open": self.open,
+            "high": self.high,
+            "low": self.low,
+            "close": self.close,
+            "volume": self.volume,
+            "vwap": self.preco_x_qtd / self.volume if self.volume > 0 else self.close,
+            "negocios": self.negocios,
+            "ultimo_negocio": pd.Timestamp(self.ultimo_negocio_ts),
+            "consultado_em": self.consultado_em,
+        }
+
+
+def _arrays_de_deals(data: list) -> tuple:
+    """Converte a lista da API em arrays (productId, ts, preço, qtd, id), sem DataFrame."""
+    validos = [
+        d for d in data
+        if d.get("originOperationType") == "Match" and d.get("status") == "Ativo"
+    ]
+    if not validos:
+        vazio = np.array([], dtype=np.int64)
+        return np.array([]), vazio, np.array([]), np.array([]), vazio
+
+    criados = pd.to_datetime([d["createdAt"] for d in validos])
+    if criados.tz is not None:
+        # Mantém o horário local do pregão, como o índice diário do histórico
+        criados = criados.tz_localize(None)
+    return (
+        np.array([d["productId"] for d in validos]),
+        criados.asi8,
+        np.fromiter((d["unitPrice"] for d in validos), dtype=float, count=len(validos)),
+        np.fromiter((d["quantity"] for d in validos), dtype=float, count=len(validos)),
+        # IDs não numéricos viram 0: a deduplicação passa a usar só o horário
+        pd.to_numeric(pd.Series([d.get("id") for d in validos]), errors="coerce")
+        .fillna(0)
+        .to_numpy(dtype=np.int64),
+    )
+
+
+def distribuir_deals(
+    barras: dict, data: list, produtos: set, consultado_em: datetime | None = None
+) -> set:
+    """
+    Refaz, a partir da resposta do dia, a barra de cada produto em `produtos`
+    (inclusive dos que ficaram sem negócios válidos, p.ex. por cancelamento).
+    Barras de produtos fora de `produtos` são descartadas.
+    Retorna os produtos cuja barra mudou.
+    """
+    ids_produto, ts, preco, qtd, ids = _arrays_de_deals(data)
+    consultado_em = consultado_em or datetime.now()
+    for pid in set(barras) - produtos:
+        del barras[pid]
+
+    # Por produto e, dentro dele, por horário
+    ordem = np.lexsort((ids, ts, ids_produto))
+    ids_produto, ts, preco, qtd = (a[ordem] for a in (ids_produto, ts, preco, qtd))
+    unicos, inicios = np.unique(ids_produto, return_index=True)
+    fins = np.append(inicios[1:], len(ids_produto))
+    faixas = {pid: (i, f) for pid, i, f in zip(unicos.tolist(), inicios, fins)}
+
+    atualizados = set()
+    for pid in produtos:
+        barra = barras.setdefault(pid, BarraIntraday())
+        i, f = faixas.get(pid, (0, 0))
+        if barra.recalcular_dia(ts[i:f], preco[i:f], qtd[i:f]):
+            atualizados.add(pid)
+        barra.consultado_em = consultado_em
+    return atualizados
+
+
+def poll_intraday(produtos: set, intervalo_s: float = 0) -> set:
+    """
+    Busca apenas os negócios de hoje e atualiza, em st.session_state.intraday,
+    as barras dos produtos exibidos. Não faz nada se a última busca foi há
+    menos de intervalo_s segundos (salvo se os produtos mudaram); se a
+    resposta é idêntica à anterior, só marca as barras como confirmadas agora.
+    Retorna os productIds cuja barra mudou.
+    """
+    if not st.session_state.get("token"):
+        return set()
+    agora = time.monotonic()
+    mesmos_produtos = set(st.session_state.get("intraday", {})) == produtos
+    ultimo_poll = st.session_state.get("intraday_ultimo_poll", -np.inf)
+    if mesmos_produtos and agora - ultimo_poll < intervalo_s:
+        return set()
+    st.session_state.intraday_ultimo_poll = agora
+
+    hoje = datetime.now().strftime("%Y-%m-%d")
+    url = AMBIENTE + f"bus/v1/all-deals/report?initialPeriod={hoje}&finalPeriod={hoje}"
+    try:
+        response = cached_get(
+            url,
+            headers={
+                "Accept": "application/json",
+                "Authorization": f"Bearer {st.session_state.token}",
+                "apiKey": st.session_state.api_key,
+            },
+            timeout=15,
+        )
+        if response.status_code != 200:
+            return set()
+        if mesmos_produtos and response.hash == st.session_state.get("intraday_hash"):
+            for barra in st.session_state.intraday.values():
+                barra.consultado_em = datetime.now()
+            return set()
+        data = json.loads(response.content)
+    except (requests.RequestException, ValueError):
+        return set()
+
+    st.session_state.intraday_hash = response.hash
+    if "intraday" not in st.session_state:
+        st.session_state.intraday = {}
+    return distribuir_deals(
+        st.session_state.intraday, data if isinstance(data, list) else [], produtos
+    )
+
+
+def aplicar_barra_intraday(
+    df_ohlc: pd.DataFrame,
+    vwap: pd.Series,
+    barra: dict | None,
+    historico_em: datetime | None = None,
+) -> tuple:
+    """
+    Retorna cópias de df_ohlc e vwap com a barra do dia substituída (ou
+    acrescentada) pela barra intraday. Se o histórico já tem a barra do
+    dia e foi atualizado (historico_em) depois da consulta que gerou a
+    intraday, o histórico é mantido. O histórico original não é alterado.
+    """
+    if not barra:
+        return df_ohlc, vwap
+
+    data = barra["data"]
+    if not df_ohlc.empty and df_ohlc.index.tz is not None:
+        data = data.tz_localize(df_ohlc.index.tz)
+    historico_mais_novo = (
+        historico_em is not None
+        and barra["consultado_em"] is not None
+        and barra["consultado_em"] <= historico_em
+    )
+    if historico_mais_novo and data in df_ohlc.index:
+        return df_ohlc, vwap
+
+    linha = pd.DataFrame(
+        {c: [barra[c]] for c in ("open", "high", "low", "close", "volume")},
+        index=pd.DatetimeIndex([data]),
+    )
+    if df_ohlc.empty:
+        df_ohlc = linha
+    else:
+        df_ohlc = pd.concat([df_ohlc[df_ohlc.index != data], linha]).sort_index()
+    vwap = vwap.copy()
+    vwap[data] = barra["vwap"]
+    return df_ohlc, vwap
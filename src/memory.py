@@ -0,0 +1,240 @@
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.cache_data_api import get_data_cache_stats_provider
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Objetos grandes de cada sessão: liberados quando ela fica ociosa e
+# reconstruídos (restaurar_dados) quando o usuário volta
+CHAVES_GRANDES = ("df", "agregados", "tickers", "produtos_ordenados", "intraday")
+# Chaves que descrevem os objetos liberados e são apagadas junto
+CHAVES_DERIVADAS = ("deals_hash", "intraday_hash", "intraday_ultimo_poll")
+
+# Registro das sessões do processo: session_id -> {estado, ultimo_uso, thread, parar, tamanhos}
+_sessoes: dict = {}
+_lock = threading.Lock()
+_ultima_verificacao = {"quando": -np.inf}
+
+
+def configuracao() -> dict:
+    """
+    Orçamento global (MEMORIA_MAX_MB), tempo sem interação do usuário para
+    uma sessão ser considerada ociosa (SESSAO_OCIOSA_MIN) e intervalo mínimo
+    entre verificações do orçamento (MEMORIA_VERIFICACAO_S).
+    """
+    return {
+        "orcamento_bytes": int(float(os.getenv("MEMORIA_MAX_MB", "1024")) * 1e6),
+        "ociosa_s": float(os.getenv("SESSAO_OCIOSA_MIN", "30")) * 60,
+        "verificacao_s": float(os.getenv("MEMORIA_VERIFICACAO_S", "60")),
+    }
+
+
+def tamanho_bytes(obj) -> int:
+    """Tamanho aproximado de um objeto guardado em session_state."""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(tamanho_bytes(o) for o in obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(
+            tamanho_bytes(k) + tamanho_bytes(v) for k, v in obj.items()
+        )
+    return sys.getsizeof(obj)
+
+
+def _tamanho_memo(registro: dict, chave: str, obj) -> int:
+    """
+    tamanho_bytes com memória por sessão: só mede de novo quando o objeto
+    muda (identidade ou tamanho), pois medir um df grande custa ~100 ms.
+    """
+    assinatura = (id(obj), len(obj) if hasattr(obj, "__len__") else None)
+    anterior = registro["tamanhos"].get(chave)
+    if anterior is not None and anterior[0] == assinatura:
+        return anterior[1]
+    tamanho = tamanho_bytes(obj)
+    registro["tamanhos"][chave] = (assinatura, tamanho)
+    return tamanho
+
+
+def medir_sessao(registro: dict) -> dict:
+    """Bytes por estrutura grande da sessão; o restante do estado vai em "outros"."""
+    estado = registro["estado"].filtered_state
+    medidas = {
+        chave: _tamanho_memo(registro, chave, estado[chave])
+        for chave in CHAVES_GRANDES
+        if chave in estado
+    }
+    medidas["outros"] = sum(
+        tamanho_bytes(v) for k, v in estado.items() if k not in CHAVES_GRANDES
+    )
+    return medidas
+
+
+def medir_caches() -> dict:
+    """Bytes por função de st.cache_data (compartilhados entre as sessões)."""
+    medidas = {}
+    for stat in get_data_cache_stats_provider().get_stats():
+        nome = stat.cache_name.rsplit(".", 1)[-1]
+        medidas[nome] = medidas.get(nome, 0) + stat.byte_length
+    return medidas
+
+
+def relatorio_memoria() -> pd.DataFrame:
+    """
+    Uma linha por (sessão, estrutura) com os bytes ocupados, mais os caches
+    compartilhados. Colunas: sessao, estrutura, bytes, ociosa_min, liberada.
+    """
+    agora = time.monotonic()
+    with _lock:
+        registros = list(_sessoes.items())
+
+    linhas = []
+    for session_id, registro in registros:
+        ociosa_min = (agora - registro["ultimo_uso"]) / 60
+        liberada = "memoria_liberada" in registro["estado"]
+        for estrutura, tamanho in medir_sessao(registro).items():
+            linhas.append((session_id[:8], estrutura, tamanho, ociosa_min, liberada))
+    for estrutura, tamanho in medir_caches().items():
+        linhas.append(("compartilhado", estrutura, tamanho, np.nan, False))
+    return pd.DataFrame(
+        linhas, columns=["sessao", "estrutura", "bytes", "ociosa_min", "liberada"]
+    )
+
+
+def registrar_sessao(interacao: bool = True) -> None:
+    """
+    Registra a sessão atual e verifica o orçamento de memória. Só execuções
+    disparadas pelo usuário (interacao=True) marcam a sessão como usada agora:
+    fragments com run_every e reruns automáticos rodam numa aba esquecida
+    aberta e não podem impedir que ela fique ociosa.
+    """
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    with _lock:
+        registro = _sessoes.setdefault(
+            ctx.session_id, {"thread": None, "parar": None, "tamanhos": {}}
+        )
+        registro["estado"] = ctx.session_state
+        if interacao or "ultimo_uso" not in registro:
+            registro["ultimo_uso"] = time.monotonic()
+    verificar_orcamento()
+
+
+def iniciar_refresh(alvo, intervalo_s: float, primeiro_em_s: float | None = None) -> None:
+    """
+    Inicia, se não estiver rodando, a thread que chama alvo() a cada
+    intervalo_s segundos para a sessão atual; a primeira chamada ocorre após
+    primeiro_em_s (padrão: intervalo_s). A thread recebe o contexto da sessão
+    (session_state é o dela) e termina quando a sessão é liberada ou se
+    desconecta; a próxima execução do script a inicia de novo.
+    """
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    with _lock:
+        registro = _sessoes.get(ctx.session_id)
+        if registro is None or (registro["thread"] and registro["thread"].is_alive()):
+            return
+        parar = threading.Event()
+        thread = threading.Thread(
+            target=_loop_refresh,
+            args=(ctx.session_id, alvo, intervalo_s, primeiro_em_s, parar),
+            daemon=True,
+        )
+        add_script_run_ctx(thread, ctx)
+        registro["thread"], registro["parar"] = thread, parar
+    thread.start()
+
+
+def _loop_refresh(
+    session_id: str, alvo, intervalo_s: float, primeiro_em_s: float | None,
+    parar: threading.Event,
+) -> None:
+    espera = intervalo_s if primeiro_em_s is None else primeiro_em_s
+    while not parar.wait(espera):
+        espera = intervalo_s
+        runtime = Runtime.instance() if Runtime.exists() else None
+        if runtime is not None and not runtime.is_active_session(session_id):
+            liberar_sessao(session_id)
+            with _lock:
+                _sessoes.pop(session_id, None)
+            return
+        alvo()
+
+
+def liberar_sessao(session_id: str) -> int:
+    """
+    Para a thread de atualização e apaga os objetos grandes da sessão,
+    marcando-a com memoria_liberada. Retorna os bytes liberados (estimados).
+    """
+    with _lock:
+        registro = _sessoes.get(session_id)
+    if registro is None:
+        return 0
+    if registro["parar"] is not None:
+        registro["parar"].set()
+
+    estado = registro["estado"]
+    liberados = 0
+    for chave in CHAVES_GRANDES + CHAVES_DERIVADAS:
+        try:
+            if chave in CHAVES_GRANDES:
+                liberados += _tamanho_memo(registro, chave, estado[chave])
+            del estado[chave]
+        except KeyError:
+            pass
+    registro["tamanhos"].clear()
+    estado["memoria_liberada"] = True
+    return liberados
+
+
+def verificar_orcamento(forcar: bool = False) -> None:
+    """
+    Remove do registro (liberando antes) as sessões desconectadas e, se o
+    total passar do orçamento, libera as sessões ociosas da que está parada
+    há mais tempo para a mais recente, até caber.
+    Roda no máximo a cada MEMORIA_VERIFICACAO_S, salvo com forcar=True.
+    """
+    config = configuracao()
+    agora = time.monotonic()
+    with _lock:
+        if not forcar and agora - _ultima_verificacao["quando"] < config["verificacao_s"]:
+            return
+        _ultima_verificacao["quando"] = agora
+        registros = list(_sessoes.items())
+
+    runtime = Runtime.instance() if Runtime.exists() else None
+    if runtime is not None:
+        for session_id, _ in registros:
+            if not runtime.is_active_session(session_id):
+                liberar_sessao(session_id)
+                with _lock:
+                    _sessoes.pop(session_id, None)
+
+    with _lock:
+        registros = list(_sessoes.items())
+    totais = {sid: sum(medir_sessao(r).values()) for sid, r in registros}
+    total = sum(totais.values()) + sum(medir_caches().values())
+    if total <= config["orcamento_bytes"]:
+        return
+
+    ociosas = sorted(
+        (r["ultimo_uso"], sid)
+        for sid, r in registros
+        if agora - r["ultimo_uso"] > config["ociosa_s"]
+        and "memoria_liberada" not in r["estado"]
+    )
+    for _, session_id in ociosas:
+        if total <= config["orcamento_bytes"]:
+            break
+        total -= liberar_sessao(session_id)
@@ -0,0 +1,179 @@
+import os
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Colunas das barras agregadas; pv = soma de preço × quantidade (para o VWAP)
+COLUNAS_BARRAS = [
+    "productId", "granularidade", "open", "high", "low", "close", "volume", "pv", "negocios"
+]
+
+
+def configuracao() -> dict:
+    """
+    Janelas de retenção (variáveis de ambiente, em dias):
+    deals brutos por RETENCAO_DEALS_DIAS, barras diárias até RETENCAO_DIARIO_DIAS,
+    semanais até RETENCAO_SEMANAL_DIAS e mensais daí para trás.
+    """
+    return {
+        "inicio": os.getenv("HISTORICO_INICIO", "2025-01-01"),
+        "deals_dias": int(os.getenv("RETENCAO_DEALS_DIAS", "365")),
+        "diario_dias": int(os.getenv("RETENCAO_DIARIO_DIAS", str(3 * 365))),
+        "semanal_dias": int(os.getenv("RETENCAO_SEMANAL_DIAS", str(5 * 365))),
+        "arquivo": os.getenv("HISTORICO_AGREGADO_FILE", ".historico/agregados.pkl"),
+    }
+
+
+def _inicio_semana(index: pd.DatetimeIndex) -> pd.DatetimeIndex:
+    dia = index.normalize()
+    return dia - pd.to_timedelta(dia.dayofweek, unit="D")
+
+
+def _inicio_mes(index: pd.DatetimeIndex) -> pd.DatetimeIndex:
+    dia = index.normalize()
+    return dia - pd.to_timedelta(dia.day - 1, unit="D")
+
+
+def _inicio_semana_no_mes(index: pd.DatetimeIndex) -> pd.DatetimeIndex:
+    """Início da semana, sem recuar ao mês anterior: a semana da virada vira duas barras."""
+    semana, mes = _inicio_semana(index), _inicio_mes(index)
+    return semana.where(semana >= mes, mes)
+
+
+def calcular_cortes(agora: pd.Timestamp, config: dict | None = None) -> dict:
+    """
+    Datas de corte de cada camada. O corte diário cai numa segunda-feira e o
+    semanal no dia 1º, para só consolidar semanas e meses completos.
+    """
+    config = config or configuracao()
+    hoje = agora.normalize()
+    bruto = hoje - pd.Timedelta(days=config["deals_dias"])
+    diario = _inicio_semana(pd.DatetimeIndex([hoje - pd.Timedelta(days=config["diario_dias"])]))[0]
+    semanal = _inicio_mes(pd.DatetimeIndex([hoje - pd.Timedelta(days=config["semanal_dias"])]))[0]
+    diario = min(diario, bruto)
+    return {"bruto": bruto, "diario": diario, "semanal": min(semanal, diario)}
+
+
+def barras_vazias(tz=None) -> pd.DataFrame:
+    barras = pd.DataFrame(columns=COLUNAS_BARRAS, index=pd.DatetimeIndex([], tz=tz))
+    return barras.astype({"productId": np.int64, "negocios": np.int64} | {
+        c: float for c in ("open", "high", "low", "close", "volume", "pv")
+    } | {"granularidade": object})
+
+
+def _barras_diarias(df_deals: pd.DataFrame) -> pd.DataFrame:
+    """Consolida deals em barras diárias por produto."""
+    if df_deals.empty:
+        return barras_vazias(df_deals.index.tz)
+    # Abertura/fechamento pelo horário, como no resample de build_ohlc
+    df_deals = df_deals.sort_index(kind="stable")
+    dia = df_deals.index.normalize()
+    barras = (
+        df_deals.assign(_dia=dia, _pv=df_deals["unitPrice"] * df_deals["quantity"])
+        .groupby(["productId", "_dia"], sort=True)
+        .agg(
+            open=("unitPrice", "first"),
+            high=("unitPrice", "max"),
+            low=("unitPrice", "min"),
+            close=("unitPrice", "last"),
+            volume=("quantity", "sum"),
+            pv=("_pv", "sum"),
+            negocios=("unitPrice", "size"),
+        )
+        .reset_index(level="productId")
+    )
+    barras.index.name = None
+    barras["granularidade"] = "D"
+    return barras[COLUNAS_BARRAS]
+
+
+def _rolar(barras: pd.DataFrame, de: str, para: str, corte, inicio_periodo) -> pd.DataFrame:
+    """Reagrupa as barras de granularidade `de` anteriores ao corte em períodos `para`."""
+    selecao = (barras["granularidade"] == de) & (barras.index < corte)
+    if not selecao.any():
+        return barras
+    antigas = barras[selecao].sort_index()
+    roladas = (
+        antigas.assign(_periodo=inicio_periodo(antigas.index))
+        .groupby(["productId", "_periodo"], sort=True)
+        .agg(
+            open=("open", "first"),
+            high=("high", "max"),
+            low=("low", "min"),
+            close=("close", "last"),
+            volume=("volume", "sum"),
+            pv=("pv", "sum"),
+            negocios=("negocios", "sum"),
+        )
+        .reset_index(level="productId")
+    )
+    roladas.index.name = None
+    roladas["granularidade"] = para
+    return pd.concat([barras[~selecao], roladas[COLUNAS_BARRAS]])
+
+
+def aplicar_retencao(
+    df_deals: pd.DataFrame, barras: pd.DataFrame, agora: pd.Timestamp | None = None
+) -> tuple:
+    """
+    Move os deals anteriores ao corte bruto para barras diárias e rola barras
+    diárias/semanais antigas para semanais/mensais.
+    Retorna (deals recentes, barras agregadas ordenadas, corte bruto).
+    """
+    agora = pd.Timestamp(agora if agora is not None else datetime.now())
+    if df_deals.index.tz is not None and agora.tz is None:
+        agora = agora.tz_localize(df_deals.index.tz)
+    cortes = calcular_cortes(agora)
+
+    antigos = df_deals.index < cortes["bruto"]
+    if antigos.any():
+        novas = _barras_diarias(df_deals[antigos])
+        barras = novas if barras.empty else pd.concat([barras, novas])
+        df_deals = df_deals[~antigos]
+    # Semanas partidas na virada do mês: cada barra semanal cabe num só mês
+    barras = _rolar(barras, "D", "W", cortes["diario"], _inicio_semana_no_mes)
+    barras = _rolar(barras, "W", "M", cortes["semanal"], _inicio_mes)
+    return df_deals, barras.sort_index(kind="stable"), cortes["bruto"]
+
+
+def barras_do_produto(barras: pd.DataFrame | None, product_id) -> pd.DataFrame | None:
+    """Barras agregadas de um produto (None se não houver)."""
+    if barras is None or barras.empty:
+        return None
+    do_produto = barras[barras["productId"] == product_id]
+    return do_produto if not do_produto.empty else None
+
+
+def carregar_agregados() -> dict | None:
+    """
+    Lê {"ate": Timestamp, "barras": DataFrame} do disco, ou None se ausente
+    ou danificado (a carga volta a começar em HISTORICO_INICIO).
+    """
+    try:
+        store = pd.read_pickle(configuracao()["arquivo"])
+    except Exception:
+        # Arquivo truncado ou corrompido pode levantar UnpicklingError,
+        # EOFError, AttributeError, ImportError... qualquer um vale "sem store"
+        return None
+    if not isinstance(store, dict) or "ate" not in store or "barras" not in store:
+        return None
+    return store
+
+
+def salvar_agregados(barras: pd.DataFrame, ate: pd.Timestamp) -> None:
+    """Grava as barras agregadas e a data até onde cobrem (gravação atômica)."""
+    caminho = Path(configuracao()["arquivo"])
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    # Nome único por gravação: o refresh de cada sessão roda numa thread própria
+    fd, tmp = tempfile.mkstemp(dir=caminho.parent, prefix=caminho.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as arquivo:
+            pd.to_pickle({"ate": ate, "barras": barras}, arquivo)
+        os.replace(tmp, caminho)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+